@@ -1,62 +1,319 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
 import os
-from passlib.context import CryptContext
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session as SQLAlchemySession
-from database import get_db, Base, engine
-from jose import JWTError
-from jose import jwt
+from database import Base, engine, SessionLocal
 import models
+from metrics import PASSWORD_HASH_DURATION, JWT_DURATION
+import tracing
+import server_timing
+import log_config
+from cache import build_cache
+from keystore import keystore
+from revocation import revoked_tokens, revoke
+from singleflight import singleflight
 
 
 
-SECRET_KEY = os.getenv("SECRET_KEY", "dc2cbe5e050232a1458d48c43328650ec84fbb4a0d91dd4cca9e6464d90fcd5b")  
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
+# ES256 signs with the rotating keys in keystore.py; HS256 uses SECRET_KEY,
+# which must then be set explicitly (there is no built-in fallback)
+ALGORITHM = os.getenv("ALGORITHM", "ES256")
+# the value once committed in backend/.env is public and never trusted
+PUBLISHED_SECRET_KEYS = {"dc2cbe5e050232a1458d48c43328650ec84fbb4a0d91dd4cca9e6464d90fcd5b"}
+SECRET_KEY = os.getenv("SECRET_KEY") or None
+if SECRET_KEY in PUBLISHED_SECRET_KEYS:
+    SECRET_KEY = None
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# During a switch from HS256 to ES256, HS256 tokens issued before the switch
+# can be accepted until they expire: set JWT_ACCEPT_LEGACY_HS256=1, SECRET_KEY,
+# and JWT_LEGACY_HS256_CUTOVER to the unix time ES256 signing started. Tokens
+# expiring after cutover + ACCESS_TOKEN_EXPIRE_MINUTES are refused, so the
+# window closes on its own.
+ACCEPT_LEGACY_HS256 = os.getenv("JWT_ACCEPT_LEGACY_HS256", "0") == "1"
+LEGACY_HS256_CUTOVER = float(os.getenv("JWT_LEGACY_HS256_CUTOVER", "0")) or None
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# argon2 releases the GIL; hashing runs on this many threads so a login storm
+# uses the CPUs without blocking the event loop for reads
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# niceness of the hashing threads, so the scheduler prefers the event loop
+# when the CPUs are saturated (Linux applies it per thread; 0 disables)
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))
 
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Cached users are snapshots of these columns; the password hash never leaves
+# the database.
+USER_CACHE_FIELDS = ("id", "username", "name", "email", "avatar", "avatar_placeholder")
+user_cache = build_cache("user")
+# invalidate_user() bumps the generation of the user's slot; a load that read
+# the row before that only caches its snapshot if the generation is unchanged,
+# so a stale row cannot be put back after the delete. Users sharing a slot at
+# worst skip a cache fill.
+USER_GENERATION_SLOTS = 4096
+_user_generations = [0] * USER_GENERATION_SLOTS
+_user_generations_lock = threading.Lock()
+
+# passlib/argon2 and jose/cryptography are only imported on first use, so
+# importing the app (workers, --reload, CLIs) does not pay for them.
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["argon2"], deprecated="auto")
+
+@lru_cache(maxsize=None)
+def _jose():
+    from jose import JWTError, jwt
+    return jwt, JWTError
+
+def _lower_hash_thread_priority():
+    if PASSWORD_HASH_NICE and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PASSWORD_HASH_NICE)
+        except OSError:
+            pass
+
+@lru_cache(maxsize=None)
+def _hash_executor():
+    return ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="argon2",
+                              initializer=_lower_hash_thread_priority)
+
+async def run_password_hashing(func, *args):
+    # off the event loop, on the bounded hashing pool; the copied context keeps
+    # tracing spans and Server-Timing phases attached to the request
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor(), call)
+
 def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+    with (
+        PASSWORD_HASH_DURATION.labels("verify").time(),
+        tracing.span("argon2.verify"),
+        server_timing.phase("hash"),
+    ):
+        return get_pwd_context().verify(plain_password, hashed_password)
+
+# Verified against when the email is unknown, so a miss costs the same argon2
+# work as a wrong password and response times don't reveal which emails exist.
+@lru_cache(maxsize=None)
+def dummy_password_hash():
+    return get_pwd_context().hash(secrets.token_urlsafe(16))
+
+async def authenticate_user(db: SQLAlchemySession, email: str, password: str):
+    user = get_user_by_email(db, email)
+    if user is None:
+        await run_password_hashing(lambda: verify_password(password, dummy_password_hash()))
+        return None
+    if not await run_password_hashing(verify_password, password, user.password):
+        return None
+    return user
 
 def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    with (
+        PASSWORD_HASH_DURATION.labels("hash").time(),
+        tracing.span("argon2.hash"),
+        server_timing.phase("hash"),
+    ):
+        return get_pwd_context().hash(password)
+
+def check_token_config():
+    # run once at startup: a bad setup stops the app instead of turning every
+    # /login into a 500
+    if ALGORITHM not in ("ES256", "HS256"):
+        raise RuntimeError(f"Unsupported ALGORITHM {ALGORITHM!r}, use ES256 or HS256")
+    if ALGORITHM == "HS256" and SECRET_KEY is None:
+        raise RuntimeError("ALGORITHM=HS256 needs SECRET_KEY to be set (the value once published in backend/.env is refused)")
+    if ACCEPT_LEGACY_HS256 and (SECRET_KEY is None or LEGACY_HS256_CUTOVER is None):
+        raise RuntimeError("JWT_ACCEPT_LEGACY_HS256=1 needs SECRET_KEY and JWT_LEGACY_HS256_CUTOVER")
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=15))
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    jwt, _ = _jose()
+    with JWT_DURATION.labels("encode").time(), tracing.span("jwt.encode"):
+        if ALGORITHM == "HS256":
+            if SECRET_KEY is None:
+                raise RuntimeError("ALGORITHM=HS256 needs SECRET_KEY to be set")
+            encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        else:
+            key = keystore.signing_key()
+            encoded_jwt = jwt.encode(to_encode, key.private, algorithm=ALGORITHM, headers={"kid": key.kid})
     return encoded_jwt
 
 def decode_access_token(token: str):
+    jwt, JWTError = _jose()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        with JWT_DURATION.labels("decode").time(), tracing.span("jwt.decode"):
+            # the accepted algorithm is pinned per branch, never taken from the token
+            header = jwt.get_unverified_header(token)
+            if header.get("alg") == "HS256" and SECRET_KEY is not None:
+                if ALGORITHM == "HS256":
+                    return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                if ACCEPT_LEGACY_HS256 and LEGACY_HS256_CUTOVER is not None:
+                    payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                    if payload.get("exp", float("inf")) <= LEGACY_HS256_CUTOVER + ACCESS_TOKEN_EXPIRE_MINUTES * 60:
+                        return payload
+                return None
+            if header.get("alg") == "ES256" and ALGORITHM == "ES256":
+                key = keystore.verification_key(header.get("kid"))
+                if key is not None:
+                    return jwt.decode(token, key, algorithms=["ES256"])
+            return None
     except JWTError:
         return None
 
+def hash_refresh_token(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_tokens(db: SQLAlchemySession, user: models.User, family_id: str | None = None):
+    # an access token plus an opaque, single-use refresh token; every refresh
+    # token descended from one login shares a family_id
+    jti = secrets.token_hex(16)
+    access_token = create_access_token(
+        data={"sub": str(user.id), "jti": jti}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    refresh_token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        user_id=user.id,
+        token_hash=hash_refresh_token(refresh_token),
+        family_id=family_id or secrets.token_hex(16),
+        access_jti=jti,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    db.commit()
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def revoke_token_family(db: SQLAlchemySession, family_id: str):
+    # revokes every refresh token of the family and the access tokens they issued
+    now = datetime.utcnow()
+    for row in db.query(models.RefreshToken).filter(models.RefreshToken.family_id == family_id):
+        if row.revoked_at is None:
+            row.revoked_at = now
+        revoke(db, row.access_jti, row.created_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    db.commit()
+
+def rotate_refresh_token(db: SQLAlchemySession, refresh_token: str):
+    RefreshToken = models.RefreshToken
+    now = datetime.utcnow()
+    row = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(refresh_token)).first()
+    if row is None or row.expires_at <= now:
+        return None
+    # claim the token atomically, so two concurrent refreshes can't both use it
+    claimed = db.query(RefreshToken).filter(RefreshToken.id == row.id, RefreshToken.revoked_at.is_(None)) \
+        .update({RefreshToken.revoked_at: now}, synchronize_session=False)
+    if not claimed:
+        # a used token came back: assume it leaked and log the whole family out
+        db.rollback()
+        revoke_token_family(db, row.family_id)
+        return None
+    user = get_user_by_id(db, row.user_id)
+    if user is None:
+        db.rollback()
+        return None
+    return issue_tokens(db, user, row.family_id)
+
 def get_user_by_email(db: SQLAlchemySession, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
+def get_user_by_id(db: SQLAlchemySession, user_id: int):
+    return db.get(models.User, user_id)
+
+def user_cache_key(user_id: int):
+    return f"id:{user_id}"
+
+def user_snapshot(user: models.User):
+    return {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+
+def user_generation(user_id: int):
+    return _user_generations[user_id % USER_GENERATION_SLOTS]
+
+def cache_user(user: models.User, generation: int | None = None):
+    # generation: as read by user_generation() before loading the row
+    with _user_generations_lock:
+        if generation is not None and generation != user_generation(user.id):
+            return
+        user_cache.set(user_cache_key(user.id), user_snapshot(user))
+
+def invalidate_user(*user_ids: int):
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    with _user_generations_lock:
+        for user_id in user_ids:
+            _user_generations[user_id % USER_GENERATION_SLOTS] += 1
+    user_cache.delete(*(user_cache_key(user_id) for user_id in user_ids))
+
+def refresh_cached_user(user: models.User):
+    # after a committed change: evict every copy, then cache the new row
+    invalidate_user(user.id)
+    cache_user(user)
+
+def handle_user_change(change: dict):
+    # called by the change feed for every updated or deleted person row
+    invalidate_user(change.get("id"))
+
 def get_user_by_username(db: SQLAlchemySession, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: SQLAlchemySession = Depends(get_db)):
+def _load_user_snapshot(subject: str):
+    # runs in a thread with its own session: the load is shared by several
+    # requests and must not depend on any one of them staying alive
+    db = SessionLocal()
+    try:
+        if subject.isdigit():
+            generation = user_generation(int(subject))
+            user = get_user_by_id(db, int(subject))
+        else:
+            # tokens issued before the subject became the user id carry the
+            # email; they are accepted until they expire, but the id is not
+            # known before the load, so their snapshot is not cached
+            user = get_user_by_email(db, subject)
+            generation = None
+        if user is None:
+            return None
+        if generation is not None:
+            cache_user(user, generation)
+        return user_snapshot(user)
+    finally:
+        db.close()
+
+# Concurrent cache misses for one user (a burst of requests, or an entry
+# expiring under load) share a single database load.
+@singleflight(key=lambda subject: subject, name="user")
+async def load_user_snapshot(subject: str):
+    return await asyncio.to_thread(_load_user_snapshot, subject)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    payload = decode_access_token(token)
-    if payload is None:
-        raise credentials_exception
-    email: str = payload.get("sub")
-    if email is None:
-        raise credentials_exception
-    user = get_user_by_email(db, email)
-    if user is None:
-        raise credentials_exception
-    return user
+    with tracing.span("auth.get_current_user"), server_timing.phase("auth"):
+        payload = decode_access_token(token)
+        if payload is None or payload.get("jti") in revoked_tokens:
+            raise credentials_exception
+        subject: str = payload.get("sub")
+        if not subject:
+            raise credentials_exception
+        snapshot = await user_cache.aget(user_cache_key(int(subject))) if subject.isdigit() else None
+        if snapshot is None:
+            snapshot = await load_user_snapshot(subject)
+            if snapshot is None:
+                raise credentials_exception
+        # detached, read-only stand-in; writers reload the row (see update_profile)
+        user = models.User(**snapshot)
+        log_config.update_request_context(user_id=user.id)
+        return user
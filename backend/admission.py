@@ -0,0 +1,203 @@
+# Admission control and load shedding.
+#
+# Every request is mapped to a route class. A class has its own concurrency
+# limit and a bounded wait queue with a deadline; a request that cannot get a
+# slot in time is answered with a fast 503 + Retry-After instead of sitting in
+# uvicorn until the client gives up.
+#
+# On top of the per-class limits there is one global in-flight budget.
+# Classes with a lower priority may only use part of it, so when the worker
+# is saturated the argon2-heavy auth routes shed load first while cheap
+# profile reads keep being served.
+
+import asyncio
+import collections
+import json
+import math
+import os
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_GLOBAL_CONCURRENCY = int(os.getenv("ADMISSION_GLOBAL_CONCURRENCY", "128"))
+
+
+class Overloaded(Exception):
+    def __init__(self, route_class: str, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteClass:
+    def __init__(self, name: str, concurrency: int, queue_size: int, max_wait: float, global_share: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        # fraction of the global budget this class may occupy
+        self.global_share = global_share
+        self.inflight = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def snapshot(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "max_wait": self.max_wait,
+            "inflight": self.inflight,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+def _env_class(name: str, concurrency: int, queue_size: int, max_wait: float, global_share: float):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return RouteClass(
+        name,
+        int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        int(os.getenv(prefix + "QUEUE", str(queue_size))),
+        float(os.getenv(prefix + "MAX_WAIT", str(max_wait))),
+        global_share,
+    )
+
+
+def default_classes():
+    # ordered from highest to lowest priority
+    return [
+        _env_class("read", concurrency=64, queue_size=256, max_wait=2.0, global_share=1.0),
+        _env_class("write", concurrency=16, queue_size=64, max_wait=2.0, global_share=0.9),
+        _env_class("default", concurrency=32, queue_size=64, max_wait=1.0, global_share=0.8),
+        # argon2 runs on PASSWORD_HASH_WORKERS (one per CPU) threads off the event
+        # loop; two slots per CPU keep those threads busy without a deep queue
+        _env_class("auth", concurrency=max(2, (os.cpu_count() or 1) * 2), queue_size=32, max_wait=1.0,
+                   global_share=0.6),
+    ]
+
+
+DEFAULT_ROUTES = {
+    ("GET", "/profile"): "read",
+    ("PUT", "/profile"): "write",
+    ("POST", "/login"): "auth",
+    ("POST", "/signup"): "auth",
+}
+
+# never limited: static files and the endpoints used to observe overload
+EXEMPT_PREFIXES = ("/avatars", "/debug", "/metrics", "/healthz", "/readyz", "/.well-known")
+
+
+class AdmissionController:
+    def __init__(self, classes=None, routes=None, global_concurrency: int = ADMISSION_GLOBAL_CONCURRENCY):
+        self.classes = {c.name: c for c in (classes or default_classes())}
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.global_concurrency = global_concurrency
+        self.inflight = 0
+
+    def classify(self, method: str, path: str):
+        return self.classes.get(self.routes.get((method, path), "default"), self.classes["default"])
+
+    def _can_admit(self, route_class: RouteClass):
+        return (
+            route_class.inflight < route_class.concurrency
+            and self.inflight < math.ceil(self.global_concurrency * route_class.global_share)
+        )
+
+    def _grant(self, route_class: RouteClass):
+        route_class.inflight += 1
+        route_class.admitted += 1
+        self.inflight += 1
+
+    async def acquire(self, route_class: RouteClass):
+        if not route_class.waiters and self._can_admit(route_class):
+            self._grant(route_class)
+            return
+        if len(route_class.waiters) >= route_class.queue_size:
+            route_class.rejected += 1
+            raise Overloaded(route_class.name, "queue full", route_class.max_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return
+            route_class.timed_out += 1
+            raise Overloaded(route_class.name, "wait deadline exceeded", route_class.max_wait)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed to us just as the client went away
+                self.release(route_class)
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                try:
+                    route_class.waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def release(self, route_class: RouteClass):
+        route_class.inflight -= 1
+        self.inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        # hand freed capacity to waiters, highest priority class first
+        for route_class in self.classes.values():
+            while route_class.waiters and self._can_admit(route_class):
+                waiter = route_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._grant(route_class)
+                waiter.set_result(True)
+
+    def snapshot(self):
+        return {
+            "global_concurrency": self.global_concurrency,
+            "inflight": self.inflight,
+            "classes": {name: c.snapshot() for name, c in self.classes.items()},
+        }
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.controller.classify(scope["method"], scope["path"])
+        try:
+            await self.controller.acquire(route_class)
+        except Overloaded as exc:
+            await self._reject(send, exc)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+    async def _reject(self, send, exc: Overloaded):
+        body = json.dumps({"detail": f"Server is overloaded ({exc.reason}), retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(exc.retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+controller = AdmissionController()
@@ -0,0 +1,163 @@
+# Garbage collector for avatar files that are no longer referenced by any user.
+# update_profile queues deletion of the replaced file, but files can still leak
+# (failed jobs, crashes, manual SQL), so this job reconciles the avatars
+# directory against person.avatar.
+#
+# Run once from the command line:
+#   python avatar_gc.py --grace-hours 24 --dry-run
+# or let main.py schedule it periodically with AVATAR_GC_INTERVAL_SECONDS.
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+import models
+from database import SessionLocal
+from jobs import job
+
+
+# where uploads are written and served from; everything else imports it from here
+AVATAR_DIR = os.getenv("AVATAR_DIR", "avatars")
+AVATAR_GC_GRACE_SECONDS = int(os.getenv("AVATAR_GC_GRACE_SECONDS", str(24 * 3600)))
+AVATAR_GC_BATCH_SIZE = int(os.getenv("AVATAR_GC_BATCH_SIZE", "500"))
+# pause between deletion batches, so a large backlog does not hog the disk
+AVATAR_GC_BATCH_PAUSE_SECONDS = float(os.getenv("AVATAR_GC_BATCH_PAUSE_SECONDS", "0.1"))
+AVATAR_GC_INTERVAL_SECONDS = int(os.getenv("AVATAR_GC_INTERVAL_SECONDS", "0"))
+AVATAR_GC_QUARANTINE_DIR = os.getenv("AVATAR_GC_QUARANTINE_DIR") or None
+
+logger = logging.getLogger(__name__)
+
+
+def scan_candidates(avatar_dir: str, grace_seconds: int, now: float | None = None):
+    # Only files older than the grace period are candidates, so an upload whose
+    # transaction has not committed yet is never mistaken for an orphan.
+    now = time.time() if now is None else now
+    cutoff = now - grace_seconds
+    candidates = set()
+    with os.scandir(avatar_dir) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False) or entry.name.startswith("."):
+                continue
+            if entry.stat(follow_symlinks=False).st_mtime <= cutoff:
+                candidates.add(entry.name)
+    return candidates
+
+
+def iter_referenced_avatars(db: SQLAlchemySession, batch_size: int):
+    # stream_results uses a server-side cursor on postgres, so memory stays
+    # bounded by batch_size instead of the number of users.
+    query = (
+        db.query(models.User.avatar)
+        .filter(models.User.avatar.isnot(None))
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for (avatar,) in query:
+        yield avatar
+
+
+def find_orphans(db: SQLAlchemySession, avatar_dir: str, grace_seconds: int, batch_size: int):
+    candidates = scan_candidates(avatar_dir, grace_seconds)
+    if not candidates:
+        return []
+    for avatar in iter_referenced_avatars(db, batch_size):
+        candidates.discard(avatar)
+        if not candidates:
+            break
+    return sorted(candidates)
+
+
+def remove_orphans(orphans, avatar_dir: str, batch_size: int, quarantine_dir: str | None = None, dry_run: bool = False,
+                   batch_pause: float = AVATAR_GC_BATCH_PAUSE_SECONDS):
+    if quarantine_dir and not dry_run:
+        os.makedirs(quarantine_dir, exist_ok=True)
+    removed = 0
+    for start in range(0, len(orphans), batch_size):
+        if start and batch_pause > 0 and not dry_run:
+            time.sleep(batch_pause)
+        for name in orphans[start:start + batch_size]:
+            path = os.path.join(avatar_dir, name)
+            if dry_run:
+                print(f"would remove {path}")
+                removed += 1
+                continue
+            try:
+                if quarantine_dir:
+                    shutil.move(path, os.path.join(quarantine_dir, name))
+                else:
+                    os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def collect_avatars(
+    avatar_dir: str = AVATAR_DIR,
+    grace_seconds: int = AVATAR_GC_GRACE_SECONDS,
+    batch_size: int = AVATAR_GC_BATCH_SIZE,
+    quarantine_dir: str | None = AVATAR_GC_QUARANTINE_DIR,
+    dry_run: bool = False,
+    batch_pause: float = AVATAR_GC_BATCH_PAUSE_SECONDS,
+):
+    if not os.path.isdir(avatar_dir):
+        return 0
+    db = SessionLocal()
+    try:
+        orphans = find_orphans(db, avatar_dir, grace_seconds, batch_size)
+    finally:
+        db.close()
+    return remove_orphans(orphans, avatar_dir, batch_size, quarantine_dir, dry_run, batch_pause)
+
+
+@job("avatar.delete")
+def delete_avatar(db: SQLAlchemySession, filename: str):
+    # the file may have been re-uploaded under the same name since it was replaced
+    if db.query(models.User.id).filter(models.User.avatar == filename).first() is not None:
+        return
+    try:
+        os.remove(os.path.join(AVATAR_DIR, os.path.basename(filename)))
+    except FileNotFoundError:
+        pass
+
+
+async def run_periodically(interval_seconds: int = AVATAR_GC_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            removed = await asyncio.to_thread(collect_avatars)
+            if removed:
+                logger.info("Avatar GC removed orphaned files", extra={"removed": removed})
+        except Exception:
+            logger.exception("Avatar GC failed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove avatar files no user references any more.")
+    parser.add_argument("--avatar-dir", default=AVATAR_DIR)
+    parser.add_argument("--grace-hours", type=float, default=AVATAR_GC_GRACE_SECONDS / 3600)
+    parser.add_argument("--batch-size", type=int, default=AVATAR_GC_BATCH_SIZE)
+    parser.add_argument("--batch-pause", type=float, default=AVATAR_GC_BATCH_PAUSE_SECONDS,
+                        help="seconds to pause between deletion batches")
+    parser.add_argument("--quarantine-dir", default=AVATAR_GC_QUARANTINE_DIR,
+                        help="move orphans here instead of deleting them")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    removed = collect_avatars(
+        avatar_dir=args.avatar_dir,
+        grace_seconds=int(args.grace_hours * 3600),
+        batch_size=args.batch_size,
+        quarantine_dir=args.quarantine_dir,
+        dry_run=args.dry_run,
+        batch_pause=args.batch_pause,
+    )
+    print(f"{'Found' if args.dry_run else 'Removed'} {removed} orphaned avatar files")
+
+
+if __name__ == "__main__":
+    main()
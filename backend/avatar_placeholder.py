@@ -0,0 +1,70 @@
+# Tiny inline placeholders for avatars (LQIP).
+# Computed once per upload by a background job and stored on the user, so the
+# frontend can paint a blurred preview before /avatars/<file> has downloaded.
+# Pillow is optional: without it uploads simply get no placeholder.
+
+import base64
+import io
+import os
+from functools import lru_cache
+
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+import models
+from avatar_gc import AVATAR_DIR
+from jobs import job
+from UserAuthMethods import invalidate_user
+
+@lru_cache(maxsize=None)
+def _pillow():
+    # imported on first upload rather than at app import
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return Image, ImageOps
+
+
+PLACEHOLDER_SIZE = 12
+PLACEHOLDER_MAX_BYTES = 400
+
+
+def _encode(image, fmt: str, quality: int):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def make_placeholder(contents: bytes) -> str | None:
+    pillow = _pillow()
+    if pillow is None or not contents:
+        return None
+    Image, ImageOps = pillow
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            # WebP keeps the header overhead down to ~100 bytes; fall back to
+            # JPEG when this Pillow build has no WebP encoder.
+            try:
+                data, mime = _encode(image, "WEBP", 30), "image/webp"
+            except (KeyError, OSError):
+                data, mime = _encode(image, "JPEG", 30), "image/jpeg"
+    except Exception:
+        return None
+    if len(data) > PLACEHOLDER_MAX_BYTES:
+        return None
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+@job("avatar.placeholder")
+def generate_avatar_placeholder(db: SQLAlchemySession, user_id: int, filename: str):
+    user = db.get(models.User, user_id)
+    # skip if the user has uploaded another avatar since this job was queued
+    if user is None or user.avatar != filename:
+        return
+    with open(os.path.join(AVATAR_DIR, filename), "rb") as f:
+        contents = f.read()
+    user.avatar_placeholder = make_placeholder(contents)
+    db.commit()
+    invalidate_user(user.id)
@@ -0,0 +1,147 @@
+# Cold-start report and bound check.
+#
+# Each run starts a fresh interpreter, imports main and runs the app's
+# lifespan startup/shutdown against a throwaway SQLite file, timing the two
+# phases separately. One extra run under `python -X importtime` attributes the
+# import cost to packages and first-party modules. With --max-import-ms or
+# --max-startup-ms the command exits 1 when the median exceeds the bound, so
+# it can guard against heavy imports creeping back in. Run from backend/:
+#
+#   python -m bench.coldstart --runs 5 --max-import-ms 800
+#   python -m bench.coldstart --out coldstart.json --compare baseline.json
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from bench import results
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(lifespan())
+print(json.dumps({"import_s": imported - started, "startup_s": ready - imported}))
+"""
+
+
+def probe_env(workdir: str):
+    env = dict(os.environ)
+    env.update({
+        "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'coldstart.db')}",
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "LOG_LEVEL": "WARNING",
+        "JWT_KEYS_DEV": "1",
+    })
+    return env
+
+
+def first_party_modules():
+    return {name[:-3] for name in os.listdir(BACKEND_DIR) if name.endswith(".py")}
+
+
+def import_report(workdir: str, top: int):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=workdir, env=probe_env(workdir), capture_output=True, text=True, check=True,
+    )
+    local = first_party_modules()
+    by_package, modules = {}, []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+        if package in local:
+            modules.append((name, int(self_us), int(cumulative_us)))
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    modules.sort(key=lambda item: item[2], reverse=True)
+    return packages, modules[:top]
+
+
+def measure(workdir: str, runs: int):
+    samples = []
+    database = os.path.join(workdir, "coldstart.db")
+    for _ in range(runs):
+        # every run creates the tables from scratch, like a fresh deploy
+        if os.path.exists(database):
+            os.remove(database)
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=workdir, env=probe_env(workdir),
+            capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"cold start probe failed:\n{completed.stderr}")
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    summary = {}
+    for phase in ("import", "startup"):
+        values = [s[f"{phase}_s"] * 1000 for s in samples]
+        summary[phase] = {
+            "runs": runs,
+            "min_ms": round(min(values), 2),
+            "median_ms": round(statistics.median(values), 2),
+            "max_ms": round(max(values), 2),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app import and startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="rows in the import-time report")
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-startup-ms", type=float, help="fail if the median lifespan startup exceeds this")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="coldstart-")
+    packages, modules = import_report(workdir, args.top)
+    print(f"{'package':32} {'self ms':>10}")
+    for package, self_us in packages:
+        print(f"{package:32} {self_us / 1000:>10.2f}")
+    print()
+    print(f"{'first-party module':32} {'self ms':>10} {'cumulative ms':>14}")
+    for name, self_us, cumulative_us in modules:
+        print(f"{name:32} {self_us / 1000:>10.2f} {cumulative_us / 1000:>14.2f}")
+    print()
+
+    summary = measure(workdir, args.runs)
+    for phase, r in summary.items():
+        print(f"{phase:8} min {r['min_ms']:.1f} ms  median {r['median_ms']:.1f} ms  max {r['max_ms']:.1f} ms")
+
+    failed = False
+    for phase, bound in (("import", args.max_import_ms), ("startup", args.max_startup_ms)):
+        if bound is not None and summary[phase]["median_ms"] > bound:
+            print(f"FAIL: median {phase} {summary[phase]['median_ms']:.1f} ms exceeds {bound:.1f} ms")
+            failed = True
+
+    meta = results.metadata("coldstart", runs=args.runs)
+    if args.out:
+        results.save(args.out, meta, summary)
+    if args.compare:
+        rows, regressions = results.compare(results.load(args.compare), {"meta": meta, "results": summary})
+        results.print_comparison(rows, regressions)
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# End-to-end load test for signup, login and profile.
+#
+# Boots the app under uvicorn in a subprocess against a throwaway SQLite file
+# (or any database given with --database-url), seeds users in bulk, drives the
+# selected workloads with concurrent httpx clients and reports throughput and
+# p50/p95/p99 per route. Run from backend/:
+#
+#   python -m bench.loadtest --users 2000 --concurrency 32 --duration 20 --out run.json
+#   python -m bench.loadtest --compare baseline.json --out run.json
+#
+# Workloads:
+#   login   - login storm against random seeded users
+#   profile - GET /profile with pre-issued tokens
+#   mixed   - 90% GET /profile, 10% PUT /profile (name change)
+#   upload  - PUT /profile with an avatar of --avatar-kb
+#   signup  - new users through POST /signup
+#   authmix - half login storm, half GET /profile: reads must stay fast while
+#             argon2 is saturated (--max-read-p50-ms turns it into a check)
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import httpx
+
+from bench import results
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_PASSWORD = "bench-password"
+WORKLOADS = ("login", "profile", "mixed", "upload", "signup", "authmix")
+
+
+def seed_email(i: int):
+    return f"bench{i}@example.com"
+
+
+def make_png(size_bytes: int, seed: int = 0):
+    # a valid PNG of random pixels close to size_bytes, so uploads exercise the
+    # placeholder job instead of failing to decode
+    rng = random.Random(seed)
+    side = max(1, int((size_bytes / 3) ** 0.5))
+    raw = b"".join(b"\x00" + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+def seed_users(database_url: str, count: int, batch_size: int = 1000):
+    # Bulk path: one argon2 hash shared by every seeded user and executemany
+    # inserts, so seeding 100k users takes seconds instead of hours of hashing.
+    os.environ["SQLALCHEMY_DATABASE_URL"] = database_url
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlalchemy import insert
+
+    import models
+    from database import Base, SessionLocal, engine
+    from UserAuthMethods import get_password_hash
+
+    Base.metadata.create_all(bind=engine)
+    hashed = get_password_hash(SEED_PASSWORD)
+    db = SessionLocal()
+    try:
+        existing = db.query(models.User.id).filter(models.User.email == seed_email(0)).first()
+        if existing is not None:
+            return
+        for start in range(0, count, batch_size):
+            rows = [
+                {"username": f"bench{i}", "name": f"Bench {i}", "email": seed_email(i), "password": hashed}
+                for i in range(start, min(count, start + batch_size))
+            ]
+            db.execute(insert(models.User), rows)
+        db.commit()
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url: str, port: int, workdir: str, extra_env: dict):
+    env = dict(os.environ)
+    env.update({
+        "SQLALCHEMY_DATABASE_URL": database_url,
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        # every request comes from 127.0.0.1 and login storms reuse emails
+        "LOGIN_THROTTLE_ENABLED": env.get("LOGIN_THROTTLE_ENABLED", "0"),
+        # one server, keys generated in the throwaway working directory
+        "JWT_KEYS_DEV": env.get("JWT_KEYS_DEV", "1"),
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/readyz")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def issue_tokens(client: httpx.AsyncClient, users: int, count: int):
+    # (token, email) pairs; PUT /profile must send the email back unchanged
+    sessions = []
+    for i in random.sample(range(users), min(users, count)):
+        r = await client.post("/login", json={"email": seed_email(i), "password": SEED_PASSWORD})
+        r.raise_for_status()
+        sessions.append((r.json()["access_token"], seed_email(i)))
+    return sessions
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route: str, latency: float, ok: bool):
+        self.latencies.setdefault(route, []).append(latency)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+
+async def timed(recorder: Recorder, route: str, request):
+    started = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code < 400
+    except httpx.TransportError:
+        ok = False
+    recorder.record(route, time.perf_counter() - started, ok)
+
+
+def make_operation(workload: str, args, sessions, avatar, counter):
+    def auth(token):
+        return {"Authorization": f"Bearer {token}"}
+
+    async def login(client, recorder):
+        i = random.randrange(args.users)
+        await timed(recorder, "POST /login",
+                    client.post("/login", json={"email": seed_email(i), "password": SEED_PASSWORD}))
+
+    async def profile(client, recorder):
+        token, _ = random.choice(sessions)
+        await timed(recorder, "GET /profile", client.get("/profile", headers=auth(token)))
+
+    async def update(client, recorder):
+        token, email = random.choice(sessions)
+        await timed(recorder, "PUT /profile", client.put(
+            "/profile", headers=auth(token), data={"name": f"Bench {random.randrange(10 ** 6)}", "email": email}))
+
+    async def mixed(client, recorder):
+        await (update if random.random() < 0.1 else profile)(client, recorder)
+
+    async def upload(client, recorder):
+        token, email = random.choice(sessions)
+        await timed(recorder, "PUT /profile (avatar)", client.put(
+            "/profile", headers=auth(token), data={"name": "Bench", "email": email},
+            files={"avatar": ("bench.png", avatar, "image/png")}))
+
+    async def signup(client, recorder):
+        i = next(counter)
+        await timed(recorder, "POST /signup", client.post("/signup", json={
+            "username": f"signup{i}-{args.run_id}", "name": "Signup", "email": f"signup{i}-{args.run_id}@example.com",
+            "password": SEED_PASSWORD}))
+
+    async def authmix(client, recorder):
+        await (login if random.random() < 0.5 else profile)(client, recorder)
+
+    return {"login": login, "profile": profile, "mixed": mixed, "upload": upload, "signup": signup,
+            "authmix": authmix}[workload]
+
+
+async def run_workload(base_url: str, workload: str, args, sessions):
+    recorder = Recorder()
+    avatar = make_png(args.avatar_kb * 1024)
+    counter = iter(range(10 ** 9))
+    operation = make_operation(workload, args, sessions, avatar, counter)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        deadline = time.monotonic() + args.duration
+
+        async def worker():
+            while time.monotonic() < deadline:
+                await operation(client, recorder)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return {
+        f"{workload}:{route}": results.summarize_latencies(latencies, elapsed, recorder.errors.get(route, 0))
+        for route, latencies in recorder.latencies.items()
+    }
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    print(f"Seeding {args.users} users into {database_url}")
+    seed_users(database_url, args.users)
+
+    port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    extra_env = {} if args.admission else {"ADMISSION_ENABLED": "0"}
+    server = start_server(database_url, port, workdir, extra_env)
+    try:
+        await wait_ready(base_url)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+            sessions = await issue_tokens(client, args.users, args.tokens)
+
+        collected = {}
+        for workload in args.workloads:
+            print(f"Running {workload} for {args.duration}s at concurrency {args.concurrency}")
+            collected.update(await run_workload(base_url, workload, args, sessions))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return collected
+
+
+def print_table(collected: dict):
+    print(f"{'workload:route':40} {'req':>8} {'err':>6} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, r in sorted(collected.items()):
+        print(f"{name:40} {r['requests']:>8} {r['errors']:>6} {r['throughput_rps']:>9.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test signup, login and profile routes")
+    parser.add_argument("--users", type=int, default=1000, help="users to seed")
+    parser.add_argument("--tokens", type=int, default=100, help="distinct logged-in users for profile workloads")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per workload")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--workloads", default="login,profile,mixed,upload",
+                        help=f"comma separated, any of {','.join(WORKLOADS)}")
+    parser.add_argument("--avatar-kb", type=int, default=64)
+    parser.add_argument("--database-url", help="disposable database to use instead of a temp SQLite file")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--admission", action="store_true", help="keep admission control on during the run")
+    parser.add_argument("--max-read-p50-ms", type=float,
+                        help="fail if GET /profile p50 in the authmix workload exceeds this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    args.workloads = [w for w in args.workloads.split(",") if w]
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+    args.run_id = int(time.time())
+
+    collected = asyncio.run(run(args))
+    print_table(collected)
+
+    meta = results.metadata(
+        "loadtest", users=args.users, concurrency=args.concurrency, duration=args.duration,
+        workloads=args.workloads, database=args.database_url or "sqlite",
+    )
+    if args.out:
+        results.save(args.out, meta, collected)
+    read = collected.get("authmix:GET /profile")
+    if args.max_read_p50_ms is not None and read is not None and read["p50_ms"] > args.max_read_p50_ms:
+        print(f"GET /profile p50 under login load is {read['p50_ms']:.1f} ms, over {args.max_read_p50_ms} ms")
+        return 1
+    if args.compare:
+        rows, regressions = results.compare(results.load(args.compare), {"meta": meta, "results": collected})
+        results.print_comparison(rows, regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
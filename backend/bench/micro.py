@@ -0,0 +1,145 @@
+# Microbenchmarks for the auth and serialization building blocks.
+#
+# Each benchmark is calibrated to run for roughly --target seconds per round,
+# repeated --repeat times; the minimum is the most stable figure to compare,
+# the median is reported alongside it. Run from backend/:
+#
+#   python -m bench.micro --out micro.json
+#   python -m bench.micro -k jwt --compare micro.json
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench import results
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_environment(users: int):
+    # the ORM lookup runs against a private SQLite file seeded with `users` rows
+    workdir = tempfile.mkdtemp(prefix="micro-")
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'micro.db')}"
+    os.environ["JWT_KEYS_DIR"] = os.path.join(workdir, "keys")
+    os.environ["JWT_KEYS_DEV"] = "1"
+    sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import insert
+
+    import models
+    from database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.execute(insert(models.User), [
+        {"username": f"micro{i}", "name": f"Micro {i}", "email": f"micro{i}@example.com", "password": "x"}
+        for i in range(users)
+    ])
+    db.commit()
+    return db
+
+
+def build_benchmarks(db, users: int):
+    from datetime import timedelta
+
+    import UserAuthMethods as auth
+    from pydantic_models import UserOut
+
+    password = "correct horse battery staple"
+    hashed = auth.get_password_hash(password)
+    token = auth.create_access_token({"sub": "1"}, timedelta(minutes=30))
+    fields = {"username": "micro1", "email": "micro1@example.com", "name": "Micro 1",
+              "avatar": "1_avatar.png", "avatar_placeholder": None}
+    user_out = UserOut(**fields)
+    lookup_email = f"micro{users // 2}@example.com"
+    lookup_id = auth.get_user_by_email(db, lookup_email).id
+    db.expunge_all()
+
+    def lookup():
+        user = auth.get_user_by_email(db, lookup_email)
+        # drop it from the identity map so every call pays for a real query
+        db.expunge(user)
+
+    def lookup_by_id():
+        db.expunge(auth.get_user_by_id(db, lookup_id))
+
+    return {
+        "auth.get_password_hash": lambda: auth.get_password_hash(password),
+        "auth.verify_password": lambda: auth.verify_password(password, hashed),
+        "auth.create_access_token": lambda: auth.create_access_token({"sub": "1"}, timedelta(minutes=30)),
+        "auth.decode_access_token": lambda: auth.decode_access_token(token),
+        "pydantic.UserOut.construct": lambda: UserOut(**fields),
+        "pydantic.UserOut.dump_json": user_out.model_dump_json,
+        "orm.get_user_by_email": lookup,
+        "orm.get_user_by_id": lookup_by_id,
+    }
+
+
+def measure(func, target: float, repeat: int):
+    # calibrate: grow the loop count until one round takes ~target seconds
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target / 10 or loops >= 10 ** 7:
+            break
+        loops *= 10
+    loops = max(1, int(loops * target / max(elapsed, 1e-9)))
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops)
+    best, median = min(timings), statistics.median(timings)
+    return {
+        "loops": loops,
+        "min_us": round(best * 1e6, 3),
+        "median_us": round(median * 1e6, 3),
+        "stdev_us": round(statistics.pstdev(timings) * 1e6, 3),
+        "ops_per_sec": round(1 / best, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for auth and serialization primitives")
+    parser.add_argument("-k", dest="match", help="only run benchmarks whose name contains this")
+    parser.add_argument("--target", type=float, default=0.5, help="seconds per round")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--users", type=int, default=10000, help="rows in the SQLite lookup table")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    db = setup_environment(args.users)
+    benchmarks = build_benchmarks(db, args.users)
+    collected = {}
+    print(f"{'benchmark':32} {'min us':>12} {'median us':>12} {'ops/s':>12}")
+    for name, func in benchmarks.items():
+        if args.match and args.match not in name:
+            continue
+        func()  # warm caches, lazy imports and validators once
+        collected[name] = measure(func, args.target, args.repeat)
+        r = collected[name]
+        print(f"{name:32} {r['min_us']:>12.3f} {r['median_us']:>12.3f} {r['ops_per_sec']:>12.1f}")
+    db.close()
+
+    meta = results.metadata("micro", target=args.target, repeat=args.repeat, users=args.users)
+    if args.out:
+        results.save(args.out, meta, collected)
+    if args.compare:
+        rows, regressions = results.compare(results.load(args.compare), {"meta": meta, "results": collected})
+        results.print_comparison(rows, regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
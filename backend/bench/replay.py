@@ -0,0 +1,229 @@
+# Replay captured production traffic against any build.
+#
+# Reads a capture written by traffic_capture.py (TRAFFIC_CAPTURE_FILE), boots
+# the app like bench.loadtest does (or targets --base-url), maps every captured
+# identity onto a seeded user and re-issues each request at its original
+# offset, divided by --speed. Arrivals are open-loop: a slow build does not
+# slow down the schedule. Latency per route is then compared with the
+# distribution recorded in production. Run from backend/:
+#
+#   python -m bench.replay traffic.jsonl --speed 4 --out replay.json
+#   python -m bench.replay traffic.jsonl --compare replay.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import loadtest, results
+
+
+MULTIPART = "multipart/form-data"
+
+
+def load_capture(path: str, limit: int = None):
+    records = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            records.append(json.loads(line))
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def route_key(record: dict):
+    return f"{record['method']} {record['route']}"
+
+
+def recorded_summary(records: list):
+    latencies = {}
+    errors = {}
+    for record in records:
+        key = route_key(record)
+        latencies.setdefault(key, []).append(record["duration_ms"] / 1000)
+        if record["status"] >= 400:
+            errors[key] = errors.get(key, 0) + 1
+    elapsed = max(records[-1]["t"] - records[0]["t"], 1e-3) if records else 1.0
+    return {key: results.summarize_latencies(values, elapsed, errors.get(key, 0)) for key, values in latencies.items()}
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, args, sessions):
+        self.client = client
+        self.args = args
+        self.sessions = sessions
+        self.assigned = {}
+        self.avatars = {}
+        self.signups = iter(range(10 ** 9))
+        self.recorder = loadtest.Recorder()
+        self.skipped = {}
+
+    def session_for(self, identity):
+        # the same captured user always maps onto the same seeded user, so
+        # per-user locality (caches, row contention) is preserved
+        if identity is None:
+            return random.choice(self.sessions)
+        if identity not in self.assigned:
+            self.assigned[identity] = self.sessions[len(self.assigned) % len(self.sessions)]
+        return self.assigned[identity]
+
+    def avatar(self, size: int):
+        # bucket to 4 KiB so a long capture does not build thousands of images
+        bucket = max(1, size // 4096) * 4096
+        if bucket not in self.avatars:
+            self.avatars[bucket] = loadtest.make_png(bucket, seed=bucket)
+        return self.avatars[bucket]
+
+    def build(self, record: dict):
+        key = route_key(record)
+        if key == "POST /login":
+            i = random.randrange(self.args.users)
+            return self.client.post("/login", json={"email": loadtest.seed_email(i),
+                                                    "password": loadtest.SEED_PASSWORD})
+        if key == "POST /signup":
+            i = next(self.signups)
+            name = f"replay{i}-{self.args.run_id}"
+            return self.client.post("/signup", json={"username": name, "name": "Replay",
+                                                     "email": f"{name}@example.com",
+                                                     "password": loadtest.SEED_PASSWORD})
+        if record["route"] == "unmatched" or "{" in record["route"]:
+            return None
+
+        token, email = self.session_for(record.get("identity"))
+        headers = {"Authorization": f"Bearer {token}"}
+        if key == "PUT /profile":
+            data = {"name": f"Replay {random.randrange(10 ** 6)}", "email": email}
+            if record.get("content_type") == MULTIPART and record["req_bytes"] > 1024:
+                files = {"avatar": ("replay.png", self.avatar(record["req_bytes"]), "image/png")}
+                return self.client.put("/profile", headers=headers, data=data, files=files)
+            return self.client.put("/profile", headers=headers, data=data)
+        if record["method"] == "GET":
+            return self.client.get(record["route"], headers=headers)
+        return None
+
+    async def fire(self, record: dict):
+        key = route_key(record)
+        request = self.build(record)
+        if request is None:
+            self.skipped[key] = self.skipped.get(key, 0) + 1
+            return
+        await loadtest.timed(self.recorder, key, request)
+
+    async def run(self, records: list):
+        origin = records[0]["t"]
+        started = time.monotonic()
+        pending = set()
+        for record in records:
+            due = started + (record["t"] - origin) / self.args.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.fire(record))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        return time.monotonic() - started
+
+
+async def replay(args, records):
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'replay.db')}"
+        print(f"Seeding {args.users} users into {database_url}")
+        loadtest.seed_users(database_url, args.users)
+        port = loadtest.free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        extra_env = {} if args.admission else {"ADMISSION_ENABLED": "0"}
+        server = loadtest.start_server(database_url, port, workdir, extra_env)
+    try:
+        await loadtest.wait_ready(base_url)
+        identities = {r["identity"] for r in records if r.get("identity")}
+        limits = httpx.Limits(max_connections=args.max_connections,
+                              max_keepalive_connections=args.max_connections)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            sessions = await loadtest.issue_tokens(client, args.users, max(1, len(identities)))
+            replayer = Replayer(client, args, sessions)
+            print(f"Replaying {len(records)} requests from {len(identities)} identities at {args.speed}x")
+            elapsed = await replayer.run(records)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    collected = {
+        key: results.summarize_latencies(latencies, elapsed, replayer.recorder.errors.get(key, 0))
+        for key, latencies in replayer.recorder.latencies.items()
+    }
+    return collected, replayer.skipped
+
+
+def print_diff(recorded: dict, replayed: dict):
+    print(f"{'route':28} {'':>9} {'req':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>6}")
+    for key in sorted(set(recorded) | set(replayed)):
+        for label, summary in (("captured", recorded.get(key)), ("replayed", replayed.get(key))):
+            if summary is None:
+                continue
+            print(f"{key:28} {label:>9} {summary['requests']:>7} {summary['p50_ms']:>9.2f} "
+                  f"{summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f} {summary['errors']:>6}")
+        if key in recorded and key in replayed:
+            ratios = [replayed[key][f] / recorded[key][f] if recorded[key][f] else float("inf")
+                      for f in ("p50_ms", "p95_ms", "p99_ms")]
+            print(f"{key:28} {'ratio':>9} {'':>7} " + " ".join(f"{r:>8.2f}x" for r in ratios))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a traffic capture and diff latency distributions")
+    parser.add_argument("capture", help="JSONL file written by traffic_capture.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay rate multiplier, 2 = twice as fast")
+    parser.add_argument("--limit", type=int, help="only replay the first N records")
+    parser.add_argument("--base-url", help="replay against a running build instead of booting one")
+    parser.add_argument("--users", type=int, default=1000, help="users to seed")
+    parser.add_argument("--database-url", help="disposable database to use instead of a temp SQLite file")
+    parser.add_argument("--admission", action="store_true", help="keep admission control on during the run")
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="earlier replay results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    random.seed(args.seed)
+    args.run_id = int(time.time())
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        parser.error(f"{args.capture} contains no records")
+    recorded = recorded_summary(records)
+    replayed, skipped = asyncio.run(replay(args, records))
+    print_diff(recorded, replayed)
+    for key, count in sorted(skipped.items()):
+        print(f"skipped {count} x {key} (no replay recipe)")
+
+    meta = results.metadata("replay", capture=os.path.basename(args.capture), records=len(records),
+                            speed=args.speed, database=args.database_url or "sqlite")
+    if args.out:
+        results.save(args.out, meta, replayed)
+    if args.compare:
+        rows, regressions = results.compare(results.load(args.compare), {"meta": meta, "results": replayed})
+        results.print_comparison(rows, regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Shared helpers for benchmark result files.
+#
+# Every benchmark writes one JSON document with a "meta" block (commit, time,
+# interpreter) and a flat "results" mapping of name -> metrics, so any two runs
+# can be compared with:
+#   python -m bench.results old.json new.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+def percentile(sorted_values, fraction: float):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies, elapsed: float, errors: int = 0):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(kind: str, **extra):
+    return {
+        "kind": kind,
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **extra,
+    }
+
+
+def save(path: str, meta: dict, results: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+
+
+def load(path: str):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# metrics where a larger number is the better one
+HIGHER_IS_BETTER = {"throughput_rps", "ops_per_sec"}
+
+
+def compare(old: dict, new: dict, threshold: float = 0.10):
+    # returns (rows, regressions); a regression is a change for the worse
+    # larger than threshold on any shared metric
+    rows, regressions = [], []
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        before, after = old["results"][name], new["results"][name]
+        for metric in sorted(set(before) & set(after)):
+            a, b = before[metric], after[metric]
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or a == 0:
+                continue
+            change = (b - a) / a
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((name, metric, a, b, change))
+            if metric != "requests" and metric != "errors" and worse > threshold:
+                regressions.append((name, metric, a, b, change))
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    for name, metric, a, b, change in rows:
+        print(f"{name:40} {metric:16} {a:>12.3f} -> {b:>12.3f}  {change * 100:+7.1f}%")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above threshold")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+    rows, regressions = compare(load(args.old), load(args.new), args.threshold)
+    print_comparison(rows, regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# Session lifecycle check: logout must end the session.
+#
+# Boots the app like bench.loadtest, logs a seeded user in and checks that
+# after POST /logout neither the access token nor the refresh token from that
+# login is accepted any more: once for a logout with only the bearer header,
+# once with the refresh token in the body, and once after a refresh (the
+# access token then belongs to a rotated refresh token). Exits 1 on the first
+# session that survives. Run from backend/:
+#
+#   python -m bench.sessioncheck
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+import httpx
+
+from bench import loadtest
+
+
+async def check(base_url: str):
+    failures = []
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        async def login():
+            r = await client.post("/login", json={"email": loadtest.seed_email(0), "password": loadtest.SEED_PASSWORD})
+            r.raise_for_status()
+            return r.json()
+
+        async def expect_ended(case: str, tokens: dict):
+            profile = await client.get("/profile", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+            refresh = await client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+            ok = profile.status_code == 401 and refresh.status_code == 401
+            print(f"{case:24} profile {profile.status_code}  refresh {refresh.status_code}  {'ok' if ok else 'FAIL'}")
+            if not ok:
+                failures.append(case)
+
+        async def logout(tokens: dict, body: dict | None = None):
+            r = await client.post("/logout", json=body,
+                                  headers={"Authorization": f"Bearer {tokens['access_token']}"})
+            assert r.status_code == 204, r.status_code
+
+        tokens = await login()
+        await logout(tokens)
+        await expect_ended("bearer only", tokens)
+
+        tokens = await login()
+        await logout(tokens, {"refresh_token": tokens["refresh_token"]})
+        await expect_ended("refresh token in body", tokens)
+
+        first = await login()
+        r = await client.post("/token/refresh", json={"refresh_token": first["refresh_token"]})
+        r.raise_for_status()
+        tokens = r.json()
+        await logout(tokens)
+        await expect_ended("after refresh", tokens)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that logout ends the session")
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="sessioncheck-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'sessioncheck.db')}"
+    loadtest.seed_users(database_url, 1)
+    port = loadtest.free_port()
+    server = loadtest.start_server(database_url, port, workdir, {})
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(loadtest.wait_ready(base_url))
+        failures = asyncio.run(check(base_url))
+    finally:
+        server.terminate()
+        server.wait()
+    if failures:
+        print(f"FAIL: session survived logout: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# Caches shared by the auth and profile paths.
+#
+# Every cache implements the same small interface (get/set/delete/clear plus
+# start/stop for background resources); values are JSON-compatible dicts.
+# The methods block, so they are called from threads; code on the event loop
+# reads through aget(), which only leaves the loop for a network round trip.
+# clear_local() drops only what this process holds. Shared tiers (redis, shm)
+# are kept current by every worker's invalidations, so a worker that may have
+# missed some (e.g. its change feed reconnected) only needs to clear its own.
+#
+#   LocalCache   in-process LRU with a TTL
+#   RedisCache   any Redis-protocol server; `redis` is an optional dependency
+#                and the client is created on first use. Pass `client=` to use
+#                fakeredis or another compatible client. A failed call opens a
+#                circuit breaker: gets and sets are skipped (a miss) for
+#                CACHE_REDIS_COOLDOWN seconds, then one call probes again.
+#   TieredCache  LocalCache in front of RedisCache. Deletes are published on a
+#                pub/sub channel and every worker evicts its local copy, so an
+#                update on one worker is not served stale by the others.
+#
+# Configuration:
+#   CACHE_BACKEND     none | local | redis | shm (default local). With several
+#                     workers use redis, or shm when they all run on one host
+#                     (see shm_cache.py), so invalidations reach all of them;
+#                     local then only bounds staleness by CACHE_LOCAL_TTL.
+#   CACHE_REDIS_URL   redis://localhost:6379/0
+#   CACHE_TTL         seconds entries live in redis (default 300)
+#   CACHE_REDIS_COOLDOWN  seconds redis is skipped after a failure (default 5)
+#   CACHE_LOCAL_SIZE  entries per process (default 10000)
+#   CACHE_LOCAL_TTL   seconds entries live in process memory (default 30)
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import CACHE_REQUESTS
+
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_REDIS_COOLDOWN = float(os.getenv("CACHE_REDIS_COOLDOWN", "5"))
+CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "10000"))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    # open after a failure: allow() refuses calls until the cooldown has passed,
+    # then lets a single caller probe; its failure opens the breaker again
+    def __init__(self, name: str, cooldown: float = CACHE_REDIS_COOLDOWN):
+        self.name = name
+        self.cooldown = cooldown
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def open(self):
+        return time.monotonic() < self._open_until
+
+    def allow(self):
+        if not self._open_until:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            self._open_until = now + self.cooldown
+            return True
+
+    def success(self):
+        if self._open_until:
+            self._open_until = 0.0
+            logger.info("Circuit closed", extra={"circuit": self.name})
+
+    def failure(self, exc: Exception):
+        with self._lock:
+            if not self._open_until:
+                logger.warning("Circuit opened", extra={
+                    "circuit": self.name, "error": repr(exc), "cooldown": self.cooldown,
+                })
+            self._open_until = time.monotonic() + self.cooldown
+
+
+class Cache:
+    name = "cache"
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float | None = None):
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    async def aget(self, key: str):
+        return self.get(key)
+
+    def clear_local(self):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _count(self, hit: bool):
+        CACHE_REQUESTS.labels(self.name, "hit" if hit else "miss").inc()
+
+
+class NullCache(Cache):
+    def __init__(self, name: str):
+        self.name = name
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: float | None = None):
+        pass
+
+    def delete(self, *keys: str):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocalCache(Cache):
+    def __init__(self, name: str, max_size: int = CACHE_LOCAL_SIZE, ttl: float = CACHE_LOCAL_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self._count(entry is not None)
+        return None if entry is None else entry[1]
+
+    def set(self, key: str, value, ttl: float | None = None):
+        expires = time.monotonic() + min(ttl or self.ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def clear_local(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(Cache):
+    def __init__(self, name: str, url: str = CACHE_REDIS_URL, ttl: float = CACHE_TTL, client=None):
+        self.name = name
+        self.url = url
+        self.ttl = ttl
+        self.prefix = f"{name}:"
+        self._client = client
+        self.breaker = CircuitBreaker(name)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        return self._client
+
+    def get(self, key: str):
+        raw = None
+        if self.breaker.allow():
+            try:
+                raw = self.client.get(self.prefix + key)
+                self.breaker.success()
+            except Exception as exc:
+                # an unreachable cache degrades to a miss, never to an error
+                self.breaker.failure(exc)
+        self._count(raw is not None)
+        return None if raw is None else json.loads(raw)
+
+    async def aget(self, key: str):
+        if self.breaker.open:
+            self._count(False)
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    def set(self, key: str, value, ttl: float | None = None):
+        if not self.breaker.allow():
+            return
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl or self.ttl)))
+            self.breaker.success()
+        except Exception as exc:
+            self.breaker.failure(exc)
+
+    def delete(self, *keys: str):
+        # not skipped while the breaker is open: a lost delete would leave a
+        # stale entry behind once redis is reachable again
+        if keys:
+            try:
+                self.client.delete(*(self.prefix + key for key in keys))
+            except Exception as exc:
+                self.breaker.failure(exc)
+                raise
+            self.breaker.success()
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+class TieredCache(Cache):
+    def __init__(self, name: str, local: LocalCache, remote: RedisCache):
+        self.name = name
+        self.local = local
+        self.remote = remote
+        self.channel = f"cache-invalidate:{name}"
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pubsub = None
+
+    def get(self, key: str):
+        value = self.local.get(key)
+        if value is None:
+            value = self.remote.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    async def aget(self, key: str):
+        value = self.local.get(key)
+        if value is None:
+            value = await self.remote.aget(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        self.remote.set(key, value, ttl)
+        self.local.set(key, value, ttl)
+
+    def delete(self, *keys: str):
+        self.local.delete(*keys)
+        try:
+            self.remote.delete(*keys)
+            self.remote.client.publish(self.channel, json.dumps(keys))
+        except Exception as exc:
+            # other workers keep their copy until CACHE_LOCAL_TTL runs out
+            logger.warning("Cache invalidation failed", extra={"cache": self.name, "error": repr(exc)})
+
+    def clear(self):
+        self.local.clear()
+        self.remote.clear()
+        self.remote.client.publish(self.channel, json.dumps(["*"]))
+
+    def clear_local(self):
+        self.local.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._listen, name=f"cache-{self.name}-invalidations", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _listen(self):
+        delay = 0.5
+        while not self._stopping.is_set():
+            try:
+                self._pubsub = self.remote.client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(self.channel)
+                # anything published while we were disconnected is lost
+                self.local.clear()
+                delay = 0.5
+                while not self._stopping.is_set():
+                    message = self._pubsub.get_message(timeout=1.0)
+                    if message is None or message.get("type") != "message":
+                        continue
+                    keys = json.loads(message["data"])
+                    if "*" in keys:
+                        self.local.clear()
+                    else:
+                        self.local.delete(*keys)
+            except Exception as exc:
+                if self._stopping.is_set():
+                    return
+                logger.warning("Cache invalidation listener disconnected",
+                               extra={"cache": self.name, "error": repr(exc), "retry_in": delay})
+                self.local.clear()
+                self._stopping.wait(delay)
+                delay = min(delay * 2, 30)
+
+
+def build_cache(name: str, backend: str = CACHE_BACKEND):
+    if backend == "none":
+        return NullCache(name)
+    if backend == "local":
+        return LocalCache(name)
+    if backend == "redis":
+        return TieredCache(name, LocalCache(f"{name}.local"), RedisCache(f"{name}.redis"))
+    if backend == "shm":
+        from shm_cache import ShmCache
+
+        return ShmCache(name)
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
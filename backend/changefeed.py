@@ -0,0 +1,202 @@
+# Change feed for the person table.
+#
+# Caches in front of user lookups are only safe with long TTLs if every change
+# to a row evicts them, including changes made by other workers, jobs, or by
+# hand in psql. Each worker runs one listener thread:
+#
+#   PostgreSQL  an AFTER UPDATE OR DELETE trigger calls pg_notify() with the
+#               row's id and (old) email; the thread LISTENs on a dedicated
+#               connection outside the pool and reconnects with backoff.
+#   SQLite      no notifications, so the thread polls person.updated_at (kept
+#               current by the ORM and by a trigger for out-of-band updates).
+#               The timestamp is taken before commit, so a row can show up
+#               after newer ones: each poll re-reads the last
+#               CHANGE_FEED_POLL_OVERLAP seconds and skips (id, updated_at)
+#               pairs it already dispatched. Deletes are not seen; they only
+#               matter until the cache TTL.
+#
+# Whenever events may have been missed (first connect, reconnect) the
+# listener calls on_reset instead; main.py drops only this process's cache
+# tier there, since shared tiers are kept current by the other workers' feeds
+# and bounded by their TTL.
+#
+# Configuration:
+#   CHANGE_FEED_ENABLED        default 1
+#   CHANGE_FEED_POLL_INTERVAL  SQLite polling interval in seconds (default 0.5)
+#   CHANGE_FEED_POLL_OVERLAP   seconds each SQLite poll looks back (default 10)
+#   CHANGE_FEED_KEEPALIVE      seconds of silence before the LISTEN connection
+#                              is checked with a query (default 30)
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, select as sql_select, text
+
+import models
+from metrics import CHANGE_FEED_EVENTS
+
+
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "1") == "1"
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "0.5"))
+CHANGE_FEED_POLL_OVERLAP = float(os.getenv("CHANGE_FEED_POLL_OVERLAP", "10"))
+CHANGE_FEED_KEEPALIVE = float(os.getenv("CHANGE_FEED_KEEPALIVE", "30"))
+CHANNEL = "person_changed"
+# arbitrary constant for pg_advisory_xact_lock, so workers don't race on the DDL
+INSTALL_LOCK_ID = 4512001
+
+logger = logging.getLogger(__name__)
+
+POSTGRES_TRIGGER = f"""
+CREATE OR REPLACE FUNCTION notify_person_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', json_build_object(
+        'op', TG_OP,
+        'id', OLD.id,
+        'email', CASE WHEN TG_OP = 'UPDATE' THEN NEW.email ELSE OLD.email END,
+        'old_email', OLD.email
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS person_changed ON person;
+CREATE TRIGGER person_changed AFTER UPDATE OR DELETE ON person
+    FOR EACH ROW EXECUTE FUNCTION notify_person_changed();
+"""
+
+SQLITE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS person_touch AFTER UPDATE ON person
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    -- same microsecond format SQLAlchemy writes, so values compare as strings
+    UPDATE person SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' WHERE id = NEW.id;
+END;
+"""
+
+
+def install(engine):
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": INSTALL_LOCK_ID})
+            conn.exec_driver_sql(POSTGRES_TRIGGER)
+        elif engine.dialect.name == "sqlite":
+            conn.exec_driver_sql(SQLITE_TRIGGER)
+
+
+class ChangeFeed:
+    def __init__(self, engine, poll_interval: float = CHANGE_FEED_POLL_INTERVAL,
+                 poll_overlap: float = CHANGE_FEED_POLL_OVERLAP):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.poll_overlap = timedelta(seconds=poll_overlap)
+        self.on_change = None
+        self.on_reset = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._connection = None
+
+    def start(self, on_change, on_reset):
+        if self._thread is not None:
+            return
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self._stopping.clear()
+        target = self._listen if self.engine.dialect.name == "postgresql" else self._poll
+        self._thread = threading.Thread(target=self._run, args=(target,), name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _dispatch(self, change: dict):
+        CHANGE_FEED_EVENTS.labels(change.get("op", "UPDATE")).inc()
+        try:
+            self.on_change(change)
+        except Exception:
+            logger.exception("Change handler failed", extra={"change": change})
+
+    def _reset(self):
+        try:
+            self.on_reset()
+        except Exception:
+            logger.exception("Change feed reset failed")
+
+    def _run(self, target):
+        delay = 0.25
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            try:
+                target()
+            except Exception as exc:
+                logger.warning("Change feed disconnected", extra={"error": repr(exc)})
+            finally:
+                self._close()
+            # back off while reconnects keep failing, start over after a healthy run
+            delay = 0.5 if time.monotonic() - started > 60 else min(delay * 2, 30)
+            self._stopping.wait(delay)
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _listen(self):
+        # a dedicated connection, detached so LISTEN doesn't pin a pool slot
+        proxied = self.engine.raw_connection()
+        proxied.detach()
+        conn = getattr(proxied, "driver_connection", None) or proxied.connection
+        self._connection = conn
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        logger.info("Listening for person changes")
+        self._reset()
+        last_seen = time.monotonic()
+        while not self._stopping.is_set():
+            readable, _, _ = select.select([conn], [], [], 1.0)
+            if not readable:
+                if time.monotonic() - last_seen > CHANGE_FEED_KEEPALIVE:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    last_seen = time.monotonic()
+                continue
+            last_seen = time.monotonic()
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self._dispatch(json.loads(notify.payload))
+
+    def _poll(self):
+        User = models.User
+        with self.engine.connect() as conn:
+            since = conn.execute(sql_select(func.max(User.updated_at))).scalar()
+        self._reset()
+        # (id, updated_at) already dispatched within the overlap window
+        seen = set()
+        while not self._stopping.wait(self.poll_interval):
+            query = sql_select(User.id, User.email, User.updated_at).order_by(User.updated_at)
+            if since is None:
+                query = query.where(User.updated_at.is_not(None))
+            else:
+                query = query.where(User.updated_at > since - self.poll_overlap)
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            for row in rows:
+                if (row.id, row.updated_at) in seen:
+                    continue
+                seen.add((row.id, row.updated_at))
+                self._dispatch({"op": "UPDATE", "id": row.id, "email": row.email})
+                since = row.updated_at if since is None else max(since, row.updated_at)
+            if since is not None:
+                horizon = since - self.poll_overlap
+                seen = {entry for entry in seen if entry[1] > horizon}
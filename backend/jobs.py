@@ -0,0 +1,280 @@
+# Durable background jobs stored in the "job" table.
+#
+# Route handlers call enqueue() with their own session; the job row is
+# committed together with the rest of the request's changes, so work is never
+# scheduled for a transaction that rolled back. Worker tasks started from
+# main.py claim due jobs, run the registered handler in a thread and retry
+# failures with exponential backoff.
+#
+# Postgres: jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any
+# number of workers and processes can poll the table at once.
+# SQLite: there is no row locking, so claims are serialised through one
+# in-process lock plus a compare-and-set UPDATE (single-writer mode).
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, or_, update
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+import models
+from database import SessionLocal, engine
+
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "2.0"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "300"))
+# a job still "running" this long after its lease was last renewed belongs to
+# a crashed worker; running jobs renew it every third of this
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# jobs whose lease ran out on their last attempt are failed by a sweep this
+# often (per process), not on every poll: on SQLite each sweep takes the write lock
+LEASE_SWEEP_INTERVAL = max(1.0, JOB_LEASE_SECONDS / 5)
+
+SINGLE_WRITER = engine.dialect.name == "sqlite"
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_claim_lock = threading.Lock()
+_worker = None
+_last_lease_sweep = float("-inf")
+
+
+def job(name: str):
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(db: SQLAlchemySession, name: str, payload: dict | None = None, delay: float = 0,
+            max_attempts: int = JOB_MAX_ATTEMPTS):
+    if name not in _handlers:
+        raise ValueError(f"Unknown job {name!r}")
+    new_job = models.Job(
+        name=name,
+        payload=payload or {},
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.add(new_job)
+    db.info["jobs_enqueued"] = True
+    return new_job
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _wake_workers(session):
+    if session.info.pop("jobs_enqueued", False) and _worker is not None:
+        _worker.wake()
+
+
+def backoff_delay(attempts: int):
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE ** attempts)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _claimable(now: datetime):
+    lease_expired = now - timedelta(seconds=JOB_LEASE_SECONDS)
+    # a re-claim after an expired lease is another attempt (claiming counts it)
+    return or_(
+        and_(models.Job.status == "queued", models.Job.run_at <= now),
+        and_(
+            models.Job.status == "running",
+            models.Job.locked_at < lease_expired,
+            models.Job.attempts < models.Job.max_attempts,
+        ),
+    )
+
+
+def _fail_exhausted_leases(db: SQLAlchemySession, now: datetime):
+    # a job that keeps taking its worker down must not be retried forever
+    db.execute(
+        update(models.Job)
+        .where(
+            models.Job.status == "running",
+            models.Job.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS),
+            models.Job.attempts >= models.Job.max_attempts,
+        )
+        .values(status="failed", locked_at=None, last_error="Lease expired on the last attempt")
+    )
+    db.commit()
+
+
+def claim_job():
+    global _last_lease_sweep
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        if time.monotonic() - _last_lease_sweep >= LEASE_SWEEP_INTERVAL:
+            _last_lease_sweep = time.monotonic()
+            _fail_exhausted_leases(db, now)
+        if SINGLE_WRITER:
+            with _claim_lock:
+                candidate = (
+                    db.query(models.Job.id, models.Job.status)
+                    .filter(_claimable(now))
+                    .order_by(models.Job.run_at, models.Job.id)
+                    .first()
+                )
+                if candidate is None:
+                    return None
+                # compare-and-set, in case another process got there first
+                result = db.execute(
+                    update(models.Job)
+                    .where(models.Job.id == candidate.id, models.Job.status == candidate.status)
+                    .values(status="running", locked_at=now, attempts=models.Job.attempts + 1)
+                )
+                db.commit()
+                return candidate.id if result.rowcount == 1 else None
+
+        claimed = (
+            db.query(models.Job)
+            .filter(_claimable(now))
+            .order_by(models.Job.run_at, models.Job.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if claimed is None:
+            db.rollback()
+            return None
+        claimed.status = "running"
+        claimed.locked_at = now
+        claimed.attempts += 1
+        db.commit()
+        return claimed.id
+    finally:
+        db.close()
+
+
+def renew_lease(job_id: int, locked_at: datetime, stop: threading.Event, interval: float | None = None):
+    # keeps a long-running job from being re-claimed by another worker; the
+    # compare on locked_at notices if the lease was taken over anyway
+    interval = interval or max(1.0, JOB_LEASE_SECONDS / 3)
+    while not stop.wait(interval):
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(models.Job)
+                .where(models.Job.id == job_id, models.Job.status == "running", models.Job.locked_at == locked_at)
+                .values(locked_at=now)
+            )
+            db.commit()
+        except Exception:
+            logger.exception("Job lease renewal failed", extra={"job_id": job_id})
+            continue
+        finally:
+            db.close()
+        if result.rowcount != 1:
+            logger.warning("Job lease lost", extra={"job_id": job_id})
+            return
+        locked_at = now
+
+
+def run_job(job_id: int):
+    db = SessionLocal()
+    stop_renewal = threading.Event()
+    try:
+        current = db.get(models.Job, job_id)
+        if current is None:
+            return
+        threading.Thread(
+            target=renew_lease, args=(job_id, current.locked_at, stop_renewal),
+            name=f"job-lease-{job_id}", daemon=True,
+        ).start()
+        handler = _handlers.get(current.name)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job {current.name!r}")
+            try:
+                handler(db, **current.payload)
+            finally:
+                stop_renewal.set()
+        except Exception:
+            db.rollback()
+            current = db.get(models.Job, job_id)
+            current.last_error = traceback.format_exc(limit=5)
+            if current.attempts < current.max_attempts:
+                current.status = "queued"
+                current.run_at = datetime.utcnow() + timedelta(seconds=backoff_delay(current.attempts))
+            else:
+                current.status = "failed"
+            current.locked_at = None
+            db.commit()
+            logger.warning("Job failed", extra={
+                "job": current.name, "job_id": job_id, "attempts": current.attempts,
+                "max_attempts": current.max_attempts, "job_status": current.status,
+            })
+            return
+        # finished jobs are deleted so the polled table only holds pending work
+        db.delete(current)
+        db.commit()
+    finally:
+        stop_renewal.set()
+        db.close()
+
+
+class JobWorker:
+    def __init__(self, concurrency: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.concurrency = 1 if SINGLE_WRITER else concurrency
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._loop = None
+        self._wakeup = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [self._loop.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job_id = await asyncio.to_thread(claim_job)
+                if job_id is not None:
+                    await asyncio.to_thread(run_job, job_id)
+                    continue
+            except Exception:
+                logger.exception("Job worker error")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def start_workers(concurrency: int = JOB_WORKERS):
+    global _worker
+    if concurrency <= 0:
+        return None
+    _worker = JobWorker(concurrency)
+    _worker.start()
+    return _worker
+
+
+async def stop_workers():
+    global _worker
+    if _worker is not None:
+        await _worker.stop()
+        _worker = None
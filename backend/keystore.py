@@ -0,0 +1,250 @@
+# Signing keys for access tokens (ES256) and the JWKS document.
+#
+# Keys are P-256 private keys stored as PEM files in JWT_KEYS_DIR, one per
+# file, named after their kid ("<created unix time>-<random>"). Every key in
+# the directory is published in /.well-known/jwks.json, so other services can
+# verify tokens without sharing a secret.
+#
+# Rotation: once the newest key is JWT_KEY_ROTATION_DAYS old a new one is
+# generated. It is published immediately but only starts signing after
+# JWKS_CACHE_SECONDS, so verifiers holding a cached JWKS already know it. A
+# superseded key stays published for JWT_KEY_RETENTION_SECONDS (longer than any
+# access token lives) and is then deleted. Workers sharing the directory
+# coordinate through a lock file and pick up each other's keys on reload; for
+# several hosts, share the directory or leave rotation enabled on one only.
+#
+# Every replica must see the same keys, so JWT_KEYS_DIR has to be an absolute
+# path (shared storage or a provisioned secret) and the first key is created
+# once, on purpose:
+#   JWT_KEYS_DIR=/srv/keys python keystore.py rotate --force
+# Startup fails on an empty directory instead of minting a key only this host
+# knows. JWT_KEYS_DEV=1 (local development) allows a relative directory and
+# generates the first key on startup.
+#
+# jose and cryptography are imported on first use, like in UserAuthMethods.
+
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "keys")
+JWT_KEYS_DEV = os.getenv("JWT_KEYS_DEV", "0") == "1"
+JWT_KEY_ROTATION_DAYS = float(os.getenv("JWT_KEY_ROTATION_DAYS", "30"))
+JWT_KEY_ROTATION_ENABLED = os.getenv("JWT_KEY_ROTATION_ENABLED", "1") == "1"
+JWT_KEY_RETENTION_SECONDS = int(os.getenv("JWT_KEY_RETENTION_SECONDS", str(24 * 3600)))
+JWT_KEY_CHECK_INTERVAL = float(os.getenv("JWT_KEY_CHECK_INTERVAL", "300"))
+JWKS_CACHE_SECONDS = int(os.getenv("JWKS_CACHE_SECONDS", "300"))
+
+KEY_ALGORITHM = "ES256"
+# an unknown kid triggers a reload (another worker may have rotated), at most this often
+RELOAD_MIN_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class SigningKey:
+    def __init__(self, kid: str, pem: bytes):
+        from jose import jwk
+
+        self.kid = kid
+        self.created = float(kid.split("-", 1)[0])
+        self.private = jwk.construct(pem, KEY_ALGORITHM)
+        self.public = self.private.public_key()
+        self.jwk = {**self.public.to_dict(), "kid": kid, "use": "sig"}
+
+
+def generate_pem():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    )
+
+
+class KeyStore:
+    def __init__(self, directory: str = JWT_KEYS_DIR, rotation_seconds: float = JWT_KEY_ROTATION_DAYS * 86400,
+                 publish_delay: float = JWKS_CACHE_SECONDS, retention: float = JWT_KEY_RETENTION_SECONDS,
+                 dev: bool = JWT_KEYS_DEV):
+        self.directory = directory
+        self.dev = dev
+        self.rotation_seconds = rotation_seconds
+        self.publish_delay = publish_delay
+        self.retention = retention
+        self._keys = {}
+        self._signing = None
+        self._jwks = None
+        self._loaded = False
+        self._last_reload = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _directory_lock(self):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_keys(self):
+        keys = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pem"):
+                continue
+            kid = name[:-4]
+            previous = self._keys.get(kid)
+            if previous is not None:
+                keys[kid] = previous
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    keys[kid] = SigningKey(kid, f.read())
+            except Exception:
+                logger.exception("Unreadable signing key", extra={"kid": kid})
+        return keys
+
+    def _write_key(self):
+        kid = f"{int(time.time())}-{secrets.token_hex(4)}"
+        path = os.path.join(self.directory, f"{kid}.pem")
+        tmp = f"{path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(generate_pem())
+        os.replace(tmp, path)
+        logger.info("Generated signing key", extra={"kid": kid})
+        return kid
+
+    def _select(self, keys: dict):
+        now = time.time()
+        ordered = sorted(keys.values(), key=lambda k: k.created)
+        # the newest key that has been published long enough to be in every
+        # verifier's cached JWKS; on a fresh install simply the newest one
+        published = [k for k in ordered if k.created + self.publish_delay <= now]
+        signing = published[-1] if published else ordered[-1]
+        body = json.dumps({"keys": [k.jwk for k in ordered]}, separators=(",", ":")).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self._lock:
+            self._keys = keys
+            self._signing = signing
+            self._jwks = (body, etag)
+            self._loaded = True
+            self._last_reload = time.monotonic()
+
+    def _check_directory(self):
+        if not self.dev and not os.path.isabs(self.directory):
+            raise RuntimeError(
+                f"JWT_KEYS_DIR must be an absolute path shared by every replica, got {self.directory!r} "
+                "(set JWT_KEYS_DEV=1 for local development)"
+            )
+
+    def _missing_keys(self):
+        return RuntimeError(
+            f"No signing keys in {self.directory}; create the first one with "
+            "`python keystore.py rotate --force` (or set JWT_KEYS_DEV=1 for local development)"
+        )
+
+    def load(self):
+        self._check_directory()
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        keys = self._read_keys()
+        if not keys:
+            if not self.dev:
+                raise self._missing_keys()
+            with self._directory_lock():
+                keys = self._read_keys()
+                if not keys:
+                    self._write_key()
+                    keys = self._read_keys()
+        self._select(keys)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def signing_key(self) -> SigningKey:
+        self._ensure_loaded()
+        return self._signing
+
+    def verification_key(self, kid: str | None):
+        self._ensure_loaded()
+        key = self._keys.get(kid)
+        if key is None and kid and time.monotonic() - self._last_reload > RELOAD_MIN_INTERVAL:
+            self.load()
+            key = self._keys.get(kid)
+        return None if key is None else key.public
+
+    def jwks(self):
+        self._ensure_loaded()
+        return self._jwks
+
+    def rotate(self, force: bool = False):
+        self._check_directory()
+        with self._directory_lock():
+            keys = self._read_keys()
+            if not keys and not (force or self.dev):
+                # the directory was emptied or swapped; a new key here would
+                # only verify on this host
+                raise self._missing_keys()
+            now = time.time()
+            newest = max((k.created for k in keys.values()), default=0)
+            if force or now - newest >= self.rotation_seconds:
+                self._write_key()
+                keys = self._read_keys()
+            # a key is superseded once its successor starts signing
+            ordered = sorted(keys.values(), key=lambda k: k.created)
+            for key, successor in zip(ordered, ordered[1:]):
+                if now > successor.created + self.publish_delay + self.retention:
+                    os.remove(os.path.join(self.directory, f"{key.kid}.pem"))
+                    keys.pop(key.kid)
+                    logger.info("Removed retired signing key", extra={"kid": key.kid})
+        self._select(keys)
+
+    def maintain(self):
+        if JWT_KEY_ROTATION_ENABLED:
+            self.rotate()
+        else:
+            self.load()
+
+    async def run_periodically(self, interval: float = JWT_KEY_CHECK_INTERVAL):
+        while True:
+            try:
+                await asyncio.to_thread(self.maintain)
+            except Exception:
+                logger.exception("Signing key maintenance failed")
+            await asyncio.sleep(interval)
+
+
+keystore = KeyStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage access token signing keys")
+    parser.add_argument("command", choices=("list", "rotate"))
+    parser.add_argument("--force", action="store_true", help="rotate even if the newest key is not due")
+    args = parser.parse_args(argv)
+
+    if args.command == "rotate":
+        keystore.rotate(force=args.force)
+    else:
+        keystore.load()
+    signing = keystore.signing_key()
+    for key in sorted(keystore._keys.values(), key=lambda k: k.created):
+        marker = "*" if key is signing else " "
+        print(f"{marker} {key.kid}  created {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(key.created))}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,206 @@
+# Structured, non-blocking logging.
+#
+# Every record is turned into one JSON line. Handlers on the request path only
+# put the record on a bounded in-memory queue; a QueueListener thread does the
+# formatting and the actual write to stdout. If the writer falls behind, new
+# records are dropped and counted rather than blocking the event loop.
+#
+# Records automatically carry the current request id, route and user id, set
+# by RequestLogMiddleware and get_current_user through a contextvar.
+#
+# Configuration:
+#   LOG_LEVEL        root level (default INFO)
+#   LOG_LEVELS       per-module levels, e.g. "sqlalchemy.engine=INFO,jobs=DEBUG"
+#   LOG_SAMPLE_RATES keep only a fraction of INFO/DEBUG records for noisy
+#                    loggers, e.g. "access=0.1"
+#   LOG_QUEUE_SIZE   records buffered before dropping (default 10000)
+#   SQL_ECHO=1       shorthand for sqlalchemy.engine=INFO
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
+_request_context = contextvars.ContextVar("log_request_context", default=None)
+_listener = None
+
+# attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+access_logger = logging.getLogger("access")
+
+
+def _parse_mapping(value: str):
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, _, val = item.partition("=")
+            mapping[key.strip()] = val.strip()
+    return mapping
+
+
+def request_context():
+    return _request_context.get()
+
+
+def update_request_context(**fields):
+    context = _request_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        context = getattr(record, "request", None)
+        if context:
+            entry.update(context)
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != "request":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the calling thread, where the request contextvar is visible.
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context is not None:
+            record.request = dict(context)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the message now (arguments may be mutated later) but leave
+        # the JSON encoding to the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    rates = {name: float(rate) for name, rate in _parse_mapping(LOG_SAMPLE_RATES).items()}
+    queue_handler.addFilter(SamplingFilter(rates))
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    levels = _parse_mapping(LOG_LEVELS)
+    if SQL_ECHO:
+        levels.setdefault("sqlalchemy.engine", "INFO")
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    # uvicorn installs its own synchronous handlers; route it through the queue
+    # and leave access logging to RequestLogMiddleware.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class RequestLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        context = {"request_id": request_id, "method": scope["method"], "path": scope["path"]}
+        token = _request_context.set(context)
+        started = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                context["route"] = route
+            access_logger.info(
+                "request finished",
+                extra={"status": status_holder[0], "latency_ms": round((time.perf_counter() - started) * 1000, 3)},
+            )
+            _request_context.reset(token)
@@ -0,0 +1,255 @@
+# Login throttling.
+#
+# Every /login attempt that reaches verify_password costs a full argon2 hash,
+# so guessing passwords doubles as a CPU exhaustion attack. The login route
+# asks the throttle before it touches the database or hashes anything; a
+# rejected attempt is answered with 429 + Retry-After for the price of a few
+# dict operations.
+#
+#   token buckets  one per client IP and one per email address; each attempt
+#                  takes a token, tokens refill at a steady rate up to a burst.
+#   lockout        after LOGIN_LOCKOUT_THRESHOLD consecutive failures for an
+#                  email, further attempts are refused for LOGIN_LOCKOUT_BASE
+#                  seconds, doubling with every further failure up to
+#                  LOGIN_LOCKOUT_MAX. A successful login resets it, and the
+#                  failure count is forgotten after LOGIN_FAILURE_WINDOW quiet
+#                  seconds.
+#
+# The local backend keeps its state in LRU-bounded dicts
+# (LOGIN_THROTTLE_MAX_KEYS per kind), so a flood of distinct IPs or emails
+# cannot grow memory without bound; it limits each worker separately. The
+# redis backend shares the state between workers and hosts (CACHE_REDIS_URL);
+# its calls run on a thread so a slow redis never blocks the event loop, and
+# after a failure a circuit breaker keeps the worker on the local buckets for
+# CACHE_REDIS_COOLDOWN seconds before redis is tried again.
+#
+# The client IP is request.client.host; behind a proxy, configure uvicorn's
+# --forwarded-allow-ips so it is the real client address.
+#
+# Configuration:
+#   LOGIN_THROTTLE_ENABLED     default 1
+#   LOGIN_THROTTLE_BACKEND     local | redis (default local)
+#   LOGIN_IP_BURST             attempts per IP in a burst (default 20)
+#   LOGIN_IP_PER_MINUTE        sustained attempts per IP (default 10)
+#   LOGIN_EMAIL_BURST          attempts per email in a burst (default 5)
+#   LOGIN_EMAIL_PER_MINUTE     sustained attempts per email (default 2)
+#   LOGIN_LOCKOUT_THRESHOLD    failures before the first lockout (default 5)
+#   LOGIN_LOCKOUT_BASE         first lockout in seconds (default 1)
+#   LOGIN_LOCKOUT_MAX          longest lockout in seconds (default 900)
+#   LOGIN_FAILURE_WINDOW       seconds until failures are forgotten (default 3600)
+#   LOGIN_THROTTLE_MAX_KEYS    tracked IPs/emails per worker (default 100000)
+
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+
+from cache import CACHE_REDIS_URL, CircuitBreaker
+from metrics import LOGIN_THROTTLED
+
+
+LOGIN_THROTTLE_ENABLED = os.getenv("LOGIN_THROTTLE_ENABLED", "1") == "1"
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "local")
+LOGIN_IP_BURST = float(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "10"))
+LOGIN_EMAIL_BURST = float(os.getenv("LOGIN_EMAIL_BURST", "5"))
+LOGIN_EMAIL_PER_MINUTE = float(os.getenv("LOGIN_EMAIL_PER_MINUTE", "2"))
+LOGIN_LOCKOUT_THRESHOLD = int(os.getenv("LOGIN_LOCKOUT_THRESHOLD", "5"))
+LOGIN_LOCKOUT_BASE = float(os.getenv("LOGIN_LOCKOUT_BASE", "1"))
+LOGIN_LOCKOUT_MAX = float(os.getenv("LOGIN_LOCKOUT_MAX", "900"))
+LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", "3600"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+logger = logging.getLogger(__name__)
+
+
+class Throttled(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def normalize_email(email: str):
+    return email.strip().lower()
+
+
+def lockout_seconds(failures: int):
+    if failures < LOGIN_LOCKOUT_THRESHOLD:
+        return 0.0
+    # cap the exponent too, 2 ** 1000 is not a useful number of seconds
+    return min(LOGIN_LOCKOUT_BASE * 2 ** min(failures - LOGIN_LOCKOUT_THRESHOLD, 32), LOGIN_LOCKOUT_MAX)
+
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+
+class LocalThrottle:
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        # bucket entries: (tokens, updated); failure entries: (count, locked_until, last_failure)
+        self._buckets = _LRU(max_keys)
+        self._failures = _LRU(max_keys)
+        self._lock = threading.Lock()
+
+    def _take(self, key: str, burst: float, per_minute: float, now: float):
+        tokens, updated = self._buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * per_minute / 60)
+        if tokens < 1:
+            self._buckets.set(key, (tokens, now))
+            return (1 - tokens) * 60 / per_minute
+        self._buckets.set(key, (tokens - 1, now))
+        return 0.0
+
+    def check(self, ip: str, email: str):
+        now = time.time()
+        with self._lock:
+            failure = self._failures.get(email)
+            if failure is not None and failure[1] > now:
+                raise Throttled("lockout", failure[1] - now)
+            wait = self._take(f"ip:{ip}", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, now)
+            if wait:
+                raise Throttled("ip", wait)
+            wait = self._take(f"email:{email}", LOGIN_EMAIL_BURST, LOGIN_EMAIL_PER_MINUTE, now)
+            if wait:
+                raise Throttled("email", wait)
+
+    def failure(self, email: str):
+        now = time.time()
+        with self._lock:
+            count, _, last = self._failures.get(email) or (0, 0.0, now)
+            count = 1 if now - last > LOGIN_FAILURE_WINDOW else count + 1
+            self._failures.set(email, (count, now + lockout_seconds(count), now))
+
+    def success(self, email: str):
+        with self._lock:
+            self._failures.pop(email)
+
+
+# refills and takes one token atomically; returns the seconds to wait (0 = allowed)
+TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisThrottle:
+    def __init__(self, url: str = CACHE_REDIS_URL, client=None, prefix: str = "login-throttle:"):
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+        self._take_script = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._client
+
+    def _take(self, key: str, burst: float, per_minute: float, now: float):
+        if self._take_script is None:
+            self._take_script = self.client.register_script(TAKE_SCRIPT)
+        return float(self._take_script(keys=[self.prefix + key], args=[burst, per_minute / 60, now]))
+
+    def check(self, ip: str, email: str):
+        now = time.time()
+        locked_until = self.client.get(f"{self.prefix}lock:{email}")
+        if locked_until is not None and float(locked_until) > now:
+            raise Throttled("lockout", float(locked_until) - now)
+        wait = self._take(f"ip:{ip}", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, now)
+        if wait:
+            raise Throttled("ip", wait)
+        wait = self._take(f"email:{email}", LOGIN_EMAIL_BURST, LOGIN_EMAIL_PER_MINUTE, now)
+        if wait:
+            raise Throttled("email", wait)
+
+    def failure(self, email: str):
+        key = f"{self.prefix}failures:{email}"
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, int(LOGIN_FAILURE_WINDOW))
+        count = pipe.execute()[0]
+        seconds = lockout_seconds(count)
+        if seconds:
+            self.client.set(f"{self.prefix}lock:{email}", time.time() + seconds, px=max(1, int(seconds * 1000)))
+
+    def success(self, email: str):
+        self.client.delete(f"{self.prefix}failures:{email}", f"{self.prefix}lock:{email}")
+
+
+class LoginThrottle:
+    def __init__(self, backend: str = LOGIN_THROTTLE_BACKEND, enabled: bool = LOGIN_THROTTLE_ENABLED):
+        self.enabled = enabled
+        self.local = LocalThrottle()
+        self.shared = RedisThrottle() if backend == "redis" else None
+        self.breaker = CircuitBreaker("login-throttle.redis")
+
+    async def _call(self, method: str, *args):
+        if self.shared is not None and self.breaker.allow():
+            try:
+                result = await asyncio.to_thread(getattr(self.shared, method), *args)
+            except Throttled:
+                self.breaker.success()
+                raise
+            except Exception as exc:
+                # an unreachable redis degrades to per-worker limits, never to an error
+                self.breaker.failure(exc)
+            else:
+                self.breaker.success()
+                return result
+        return getattr(self.local, method)(*args)
+
+    async def check(self, ip: str, email: str):
+        if not self.enabled:
+            return
+        try:
+            await self._call("check", ip or "unknown", normalize_email(email))
+        except Throttled as exc:
+            LOGIN_THROTTLED.labels(exc.reason).inc()
+            raise
+
+    async def failure(self, email: str):
+        if self.enabled:
+            await self._call("failure", normalize_email(email))
+
+    async def success(self, email: str):
+        if self.enabled:
+            await self._call("success", normalize_email(email))
+
+
+throttle = LoginThrottle()
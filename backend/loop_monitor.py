@@ -0,0 +1,133 @@
+# Event-loop lag watchdog.
+# A heartbeat task measures how late the loop wakes it up, and a monitoring
+# thread notices when the heartbeat stops altogether. When the loop has been
+# stalled longer than the threshold, the thread captures the stack the loop
+# thread is stuck in, which points straight at the blocking call
+# (argon2, sync SQLAlchemy, file writes, ...).
+
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_MONITOR_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.1"))
+LOOP_MONITOR_MAX_STALLS = int(os.getenv("LOOP_MONITOR_MAX_STALLS", "50"))
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LagHistogram:
+    def __init__(self, buckets=LAG_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count, maximum = self.total, self.count, self.max
+        cumulative, buckets = 0, []
+        for bound, n in zip(list(self.buckets) + ["+Inf"], counts):
+            cumulative += n
+            buckets.append({"le": bound, "count": cumulative})
+        return {"count": count, "sum": total, "max": maximum, "buckets": buckets}
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_MONITOR_THRESHOLD,
+                 max_stalls: int = LOOP_MONITOR_MAX_STALLS):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = LagHistogram()
+        self.stalls = collections.deque(maxlen=max_stalls)
+        self._beats = 0
+        self._last_beat = time.monotonic()
+        self._reported_beat = -1
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self.histogram.observe(lag)
+            if self._reported_beat == self._beats and self.stalls:
+                # the stall we reported has ended; record how long it really was
+                self.stalls[-1]["stalled_for"] = now - self._last_beat
+            self._last_beat = now
+            self._beats += 1
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            beat = self._beats
+            stalled_for = time.monotonic() - self._last_beat
+            if stalled_for < self.threshold + self.interval or beat == self._reported_beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            self._reported_beat = beat
+            self.stalls.append({
+                "detected_at": time.time(),
+                "stalled_for": stalled_for,
+                "stack": [line.rstrip() for line in stack],
+            })
+            logger.warning("Event loop blocked", extra={
+                "stalled_ms": round(stalled_for * 1000, 1), "stack": "".join(stack[-3:]),
+            })
+
+    def report(self):
+        return {
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag": self.histogram.snapshot(),
+            "stalls": list(self.stalls),
+        }
+
+
+monitor = LoopMonitor()
@@ -1,19 +1,111 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, PlainTextResponse, JSONResponse
 from sqlalchemy.orm import Session as SQLAlchemySession
 import models
 from database import get_db, Base, engine
 import os
-from pydantic_models import UserIn, UserLogin, UserOut, Token 
-from UserAuthMethods import get_password_hash, verify_password, get_current_user, get_user_by_email, get_user_by_username, create_access_token, decode_access_token
-app = FastAPI()
+import math
+import asyncio
+import logging
+import log_config
+import avatar_gc
+import avatar_placeholder
+import jobs
+import schema
+from admin import require_admin
+from loop_monitor import monitor as loop_monitor, LOOP_MONITOR_ENABLED
+from admission import AdmissionControlMiddleware, ADMISSION_ENABLED, controller as admission_controller
+import metrics
+import tracing
+import server_timing
+from profiler import profiler, ProfilerMiddleware, ProfilerBusy
+import traffic_capture
+from warmup import warmup, WARMUP_ENABLED
+from keystore import keystore, JWKS_CACHE_SECONDS
+from revocation import revoke, revocation_sync
+from changefeed import ChangeFeed, CHANGE_FEED_ENABLED, install as install_change_feed
+from memdiag import diagnostics as memdiag, AllocationMiddleware, MEMDIAG_ENABLED, KEY_TYPES
+from pydantic_models import UserIn, UserLogin, UserOut, Token, RefreshRequest, LogoutRequest
+from login_throttle import throttle as login_throttle, Throttled
+from UserAuthMethods import get_password_hash, verify_password, authenticate_user, run_password_hashing, get_current_user, get_user_by_email, get_user_by_username, create_access_token, decode_access_token, cache_user, refresh_cached_user, handle_user_change, user_cache, oauth2_scheme, issue_tokens, rotate_refresh_token, revoke_token_family, hash_refresh_token, check_token_config, ALGORITHM
+logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-def startup_event():
-    Base.metadata.create_all(bind=engine)
-    print("Tables created successfully!")
+
+# Everything that touches the filesystem, the database or starts threads and
+# tasks happens here rather than at import, so importing the app stays cheap.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_config.setup_logging()
+    check_token_config()
+    os.makedirs(avatar_gc.AVATAR_DIR, exist_ok=True)
+    await asyncio.to_thread(Base.metadata.create_all, bind=engine)
+    await asyncio.to_thread(schema.upgrade, engine)
+    logger.info("Tables created successfully!")
+
+    tasks = []
+    if avatar_gc.AVATAR_GC_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(avatar_gc.run_periodically()))
+    await jobs.start_workers()
+    if MEMDIAG_ENABLED:
+        memdiag.start()
+    tasks.append(asyncio.create_task(memdiag.run_periodically()))
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    if ALGORITHM == "ES256":
+        # fails without a key instead of minting one only this host knows
+        await asyncio.to_thread(keystore.load)
+        tasks.append(asyncio.create_task(keystore.run_periodically()))
+    await asyncio.to_thread(revocation_sync.sync)
+    tasks.append(asyncio.create_task(revocation_sync.run_periodically()))
+    user_cache.start()
+    change_feed = ChangeFeed(engine)
+    if CHANGE_FEED_ENABLED:
+        await asyncio.to_thread(install_change_feed, engine)
+        change_feed.start(on_change=handle_user_change, on_reset=user_cache.clear_local)
+
+    if WARMUP_ENABLED:
+        if not await asyncio.to_thread(warmup.run, engine):
+            tasks.append(asyncio.create_task(warmup.retry(engine)))
+    else:
+        warmup.skip()
+    try:
+        yield
+    finally:
+        warmup.stop()
+        await loop_monitor.stop()
+        await jobs.stop_workers()
+        change_feed.stop()
+        user_cache.stop()
+        for task in tasks:
+            task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+# The last middleware added runs first: CORS wraps everything so 503s still
+# carry CORS headers, and metrics also see requests shed by admission control.
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware, controller=admission_controller)
+app.add_middleware(metrics.MetricsMiddleware)
+if tracing.TRACE_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+    tracing.instrument_engine(engine)
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+app.add_middleware(AllocationMiddleware, diagnostics=memdiag)
+if server_timing.SERVER_TIMING_ENABLED:
+    app.add_middleware(server_timing.ServerTimingMiddleware)
+    server_timing.instrument_engine(engine)
+if traffic_capture.TRAFFIC_CAPTURE_FILE:
+    app.add_middleware(traffic_capture.TrafficCaptureMiddleware)
+app.add_middleware(log_config.RequestLogMiddleware)
+
+metrics.REGISTRY.register_collector(metrics.pool_collector(engine))
+metrics.REGISTRY.register_collector(metrics.loop_lag_collector(loop_monitor))
+metrics.REGISTRY.register_collector(metrics.admission_collector(admission_controller))
 
 origins = ["*"]
 
@@ -25,11 +117,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-os.makedirs("avatars", exist_ok=True) 
-app.mount("/avatars", StaticFiles(directory="avatars"), name="avatars")
+# the directory is created by the lifespan handler
+app.mount("/avatars", StaticFiles(directory=avatar_gc.AVATAR_DIR, check_dir=False), name="avatars")
 
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+def to_user_out(user: models.User):
+    with server_timing.phase("serialize"):
+        return UserOut(
+            username=user.username,
+            email=user.email,
+            name=user.name,
+            avatar=user.avatar,
+            avatar_placeholder=user.avatar_placeholder
+        )
 
 # API routes
 
@@ -43,7 +143,7 @@ async def signup(user: UserIn, db: SQLAlchemySession = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email or username already registered"
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await run_password_hashing(get_password_hash, user.password)
     new_user = models.User(
         username=user.username,
         name=user.name,
@@ -54,38 +154,76 @@ async def signup(user: UserIn, db: SQLAlchemySession = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    # the cache may be redis; keep its round trips off the event loop
+    await asyncio.to_thread(cache_user, new_user)
 
-    return UserOut(
-        username=new_user.username,
-        email=new_user.email,
-        name=new_user.name,
-        avatar=new_user.avatar
-    )
+    return to_user_out(new_user)
 
 @app.post("/login", response_model=Token)
-async def login(user_in: UserLogin, db: SQLAlchemySession = Depends(get_db)):
-    user = get_user_by_email(db, user_in.email)
-    print("Login")
-    if not user or not verify_password(user_in.password, user.password):
+async def login(user_in: UserLogin, request: Request, db: SQLAlchemySession = Depends(get_db)):
+    # throttled attempts are refused before any database or argon2 work
+    try:
+        await login_throttle.check(request.client.host if request.client else None, user_in.email)
+    except Throttled as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
+    user = await authenticate_user(db, user_in.email, user_in.password)
+    if user is None:
+        await login_throttle.failure(user_in.email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    await login_throttle.success(user_in.email)
+    return issue_tokens(db, user)
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh(body: RefreshRequest, db: SQLAlchemySession = Depends(get_db)):
+    # no password hash here: one indexed lookup and a row insert
+    tokens = rotate_refresh_token(db, body.refresh_token)
+    if tokens is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return tokens
+
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    body: LogoutRequest | None = None,
+    token: str = Depends(oauth2_scheme),
+    db: SQLAlchemySession = Depends(get_db)
+):
+    payload = decode_access_token(token)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    revoke(db, payload.get("jti"), datetime.utcfromtimestamp(payload["exp"]))
+    db.commit()
+    if body is not None and body.refresh_token:
+        row = db.query(models.RefreshToken).filter(
+            models.RefreshToken.token_hash == hash_refresh_token(body.refresh_token)
+        ).first()
+    else:
+        # without a refresh token, end the session the access token was issued for
+        row = db.query(models.RefreshToken).filter(
+            models.RefreshToken.access_jti == payload.get("jti")
+        ).first()
+    if row is not None:
+        revoke_token_family(db, row.family_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.get("/profile", response_model=UserOut)
 async def get_profile(current_user: models.User = Depends(get_current_user)):
-    return UserOut(
-        username=current_user.username,
-        email=current_user.email,
-        name=current_user.name,
-        avatar=current_user.avatar
-    )
+    return to_user_out(current_user)
 
 @app.put("/profile", response_model=UserOut)
 async def update_profile(
@@ -96,30 +234,131 @@ async def update_profile(
     db: SQLAlchemySession = Depends(get_db)
 ):
     
-    user = current_user
+    # current_user may be a cached snapshot; always write through the real row
+    user = db.get(models.User, current_user.id)
     user.name = name
     user.email = email
 
     if avatar:
-        os.makedirs("avatars", exist_ok=True)
+        os.makedirs(avatar_gc.AVATAR_DIR, exist_ok=True)
         filename = f"{user.id}_{avatar.filename}"
-        filepath = os.path.join("avatars", filename)
-        contents = await avatar.read()
-        with open(filepath, "wb") as f:
-            f.write(contents)
+        filepath = os.path.join(avatar_gc.AVATAR_DIR, filename)
+        with server_timing.phase("file"):
+            contents = await avatar.read()
+            with open(filepath, "wb") as f:
+                f.write(contents)
+        metrics.AVATAR_UPLOAD_BYTES.observe(len(contents))
+        if user.avatar and user.avatar != filename:
+            jobs.enqueue(db, "avatar.delete", {"filename": user.avatar})
         user.avatar = filename
+        user.avatar_placeholder = None
+        jobs.enqueue(db, "avatar.placeholder", {"user_id": user.id, "filename": filename})
 
     db.add(user)
     db.commit()
     db.refresh(user)
+    await asyncio.to_thread(refresh_cached_user, user)
 
-    return UserOut(
-        username=user.username,
-        email=user.email,
-        name=user.name,
-        avatar=user.avatar
-    )
-startup_event()
+    return to_user_out(user)
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    if not warmup.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"status": "not ready", **warmup.report()})
+    return {"status": "ready", **warmup.report()}
+
+@app.get("/.well-known/jwks.json", include_in_schema=False)
+async def jwks(request: Request):
+    if ALGORITHM != "ES256":
+        # HS256 tokens are verified with a shared secret, nothing to publish
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    body, etag = keystore.jwks()
+    headers = {"Cache-Control": f"public, max-age={JWKS_CACHE_SECONDS}", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+# Diagnostics routes
+
+@app.get("/debug/loop-lag", dependencies=[Depends(require_admin)])
+async def loop_lag_report():
+    return loop_monitor.report()
+
+@app.get("/debug/admission", dependencies=[Depends(require_admin)])
+async def admission_report():
+    return admission_controller.snapshot()
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)])
+async def cpu_profile(
+    seconds: float = 10,
+    requests: int | None = None,
+    path: str = "/",
+    timeout: float = 60,
+    format: str = "collapsed",
+):
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be collapsed or speedscope")
+    try:
+        if requests:
+            result = await asyncio.to_thread(profiler.profile_requests, path, requests, timeout)
+        else:
+            result = await asyncio.to_thread(profiler.profile_for, seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+    if format == "speedscope":
+        return result.speedscope(name=f"{path} x{requests}" if requests else f"{seconds}s")
+    return PlainTextResponse(result.collapsed())
+
+@app.get("/debug/memory", dependencies=[Depends(require_admin)])
+async def memory_status():
+    return memdiag.status()
+
+@app.post("/debug/memory/start", dependencies=[Depends(require_admin)])
+async def memory_start(frames: int | None = None, request_allocs: bool | None = None):
+    memdiag.start(frames)
+    if request_allocs is not None:
+        memdiag.request_allocs = request_allocs
+    return memdiag.status()
+
+@app.post("/debug/memory/stop", dependencies=[Depends(require_admin)])
+async def memory_stop():
+    memdiag.stop()
+    return memdiag.status()
+
+@app.post("/debug/memory/snapshots", dependencies=[Depends(require_admin)])
+async def memory_take_snapshot():
+    try:
+        snapshot_id = await asyncio.to_thread(memdiag.take_snapshot)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    return {"id": snapshot_id}
+
+@app.get("/debug/memory/snapshots/{snapshot_id}", dependencies=[Depends(require_admin)])
+async def memory_top(snapshot_id: int, key: str = "lineno", limit: int = 25):
+    if key not in KEY_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"key must be one of {KEY_TYPES}")
+    try:
+        return await asyncio.to_thread(memdiag.top, snapshot_id, key, limit)
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+
+@app.get("/debug/memory/diff", dependencies=[Depends(require_admin)])
+async def memory_diff(from_id: int, to_id: int, key: str = "lineno", limit: int = 25):
+    if key not in KEY_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"key must be one of {KEY_TYPES}")
+    try:
+        return await asyncio.to_thread(memdiag.diff, from_id, to_id, key, limit)
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,170 @@
+# Memory allocation diagnostics built on tracemalloc.
+#
+# tracemalloc can be switched on at startup (MEMDIAG_ENABLED=1) or at runtime
+# through the admin endpoints, so a worker that is already creeping can be
+# inspected without a restart. While it runs, a background task keeps the last
+# few snapshots; the endpoints show the top allocation sites of a snapshot and
+# the diff between two of them, which is what points at a leak.
+#
+# MEMDIAG_REQUEST_ALLOCS=1 additionally measures the traced memory around each
+# request. tracemalloc counters are process-wide, so with concurrent requests
+# the per-route numbers are an approximation; run it under low concurrency
+# when the exact figure matters.
+
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+
+MEMDIAG_ENABLED = os.getenv("MEMDIAG_ENABLED", "0") == "1"
+MEMDIAG_FRAMES = int(os.getenv("MEMDIAG_FRAMES", "10"))
+MEMDIAG_SNAPSHOT_INTERVAL = float(os.getenv("MEMDIAG_SNAPSHOT_INTERVAL", "300"))
+MEMDIAG_KEEP = int(os.getenv("MEMDIAG_KEEP", "6"))
+MEMDIAG_REQUEST_ALLOCS = os.getenv("MEMDIAG_REQUEST_ALLOCS", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+KEY_TYPES = ("lineno", "filename", "traceback")
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class RouteAllocations:
+    __slots__ = ("requests", "net_bytes", "max_net_bytes")
+
+    def __init__(self):
+        self.requests = 0
+        self.net_bytes = 0
+        self.max_net_bytes = 0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "net_bytes": self.net_bytes,
+            "avg_net_bytes": self.net_bytes / self.requests if self.requests else 0,
+            "max_net_bytes": self.max_net_bytes,
+        }
+
+
+class MemoryDiagnostics:
+    def __init__(self, keep: int = MEMDIAG_KEEP, frames: int = MEMDIAG_FRAMES):
+        self.frames = frames
+        self.snapshots = collections.OrderedDict()
+        self.keep = keep
+        self.request_allocs = MEMDIAG_REQUEST_ALLOCS
+        self.routes = collections.defaultdict(RouteAllocations)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, frames: int | None = None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or self.frames)
+
+    def stop(self):
+        tracemalloc.stop()
+        with self._lock:
+            self.snapshots.clear()
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            snapshot_id = next(self._ids)
+            self.snapshots[snapshot_id] = (time.time(), current, peak, snapshot)
+            while len(self.snapshots) > self.keep:
+                self.snapshots.popitem(last=False)
+        return snapshot_id
+
+    def _get(self, snapshot_id: int):
+        with self._lock:
+            entry = self.snapshots.get(snapshot_id)
+        if entry is None:
+            raise KeyError(snapshot_id)
+        return entry[3]
+
+    def top(self, snapshot_id: int, key_type: str = "lineno", limit: int = 25):
+        stats = self._get(snapshot_id).statistics(key_type)
+        return [
+            {"size": stat.size, "count": stat.count, "site": stat.traceback.format(limit=self.frames)}
+            for stat in stats[:limit]
+        ]
+
+    def diff(self, from_id: int, to_id: int, key_type: str = "lineno", limit: int = 25):
+        stats = self._get(to_id).compare_to(self._get(from_id), key_type)
+        return [
+            {
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+                "site": stat.traceback.format(limit=self.frames),
+            }
+            for stat in stats[:limit]
+        ]
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._lock:
+            snapshots = [
+                {"id": snapshot_id, "taken_at": taken_at, "traced_bytes": size, "peak_bytes": peak_size}
+                for snapshot_id, (taken_at, size, peak_size, _) in self.snapshots.items()
+            ]
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": snapshots,
+            "request_allocs": self.request_allocs,
+            "routes": {route: stats.as_dict() for route, stats in list(self.routes.items())},
+        }
+
+    def record_request(self, route: str, net_bytes: int):
+        stats = self.routes[route]
+        stats.requests += 1
+        stats.net_bytes += net_bytes
+        if net_bytes > stats.max_net_bytes:
+            stats.max_net_bytes = net_bytes
+
+    async def run_periodically(self, interval: float = MEMDIAG_SNAPSHOT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            if tracemalloc.is_tracing():
+                try:
+                    # snapshotting walks every traced block; keep it off the loop
+                    await asyncio.to_thread(self.take_snapshot)
+                except Exception:
+                    logger.exception("Memory snapshot failed")
+
+
+class AllocationMiddleware:
+    def __init__(self, app, diagnostics: MemoryDiagnostics):
+        self.app = app
+        self.diagnostics = diagnostics
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.diagnostics.request_allocs or not tracemalloc.is_tracing()
+                or scope["path"].startswith("/debug")):
+            await self.app(scope, receive, send)
+            return
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.diagnostics.record_request(f"{scope['method']} {route}", tracemalloc.get_traced_memory()[0] - before)
+
+
+diagnostics = MemoryDiagnostics()
@@ -0,0 +1,291 @@
+# Minimal Prometheus-compatible metrics.
+#
+# Metrics are plain objects updated in-process and rendered in the Prometheus
+# text exposition format at /metrics. Each labelled child owns a tiny lock
+# that is only ever contended by concurrent updates of the same series, and
+# values that already live elsewhere (pool state, loop lag, admission
+# control) are read by collectors at scrape time instead of being mirrored on
+# every request.
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+SIZE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 500 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _series(self):
+        if not self.labelnames:
+            return [((), self._default)]
+        return list(self._children.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        return render_histogram(name, labelnames, values, self.buckets, counts, total)
+
+
+def render_histogram(name, labelnames, values, buckets, counts, total):
+    lines, cumulative = [], 0
+    for bound, n in zip(list(buckets) + [float("inf")], counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', _format_value(float(bound)))])} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+    return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        # collector() returns already formatted exposition lines
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as exc:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {exc!r}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"))
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "argon2 hash/verify duration", ("operation",), buckets=DEFAULT_BUCKETS)
+JWT_DURATION = Histogram("jwt_duration_seconds", "JWT encode/decode duration", ("operation",), buckets=FAST_BUCKETS)
+AVATAR_UPLOAD_BYTES = Histogram("avatar_upload_bytes", "Size of uploaded avatar files", buckets=SIZE_BUCKETS)
+CHANGE_FEED_EVENTS = Counter("change_feed_events_total", "Row change notifications received, by operation", ("op",))
+SINGLEFLIGHT_CALLS = Counter("singleflight_calls_total", "Coalesced calls by group and role (leader/shared)", ("group", "role"))
+LOGIN_THROTTLED = Counter("login_throttled_total", "Login attempts refused before hashing, by reason", ("reason",))
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+
+
+def _gauge_lines(name, documentation, samples, kind="gauge"):
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels([k for k, _ in labels], [v for _, v in labels])} {_format_value(value)}")
+    return lines
+
+
+def pool_collector(engine):
+    def collect_pool():
+        pool = engine.pool
+        samples = []
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, state, None)
+            if callable(method):
+                samples.append(((("state", state),), method()))
+        return _gauge_lines("db_pool_connections", "SQLAlchemy connection pool state", samples)
+    return collect_pool
+
+
+def loop_lag_collector(monitor):
+    def collect_loop_lag():
+        snapshot = monitor.histogram.snapshot()
+        name = "event_loop_lag_seconds"
+        lines = [f"# HELP {name} Event loop scheduling lag", f"# TYPE {name} histogram"]
+        counts, previous = [], 0
+        for bucket in snapshot["buckets"]:
+            counts.append(bucket["count"] - previous)
+            previous = bucket["count"]
+        lines.extend(render_histogram(name, (), (), monitor.histogram.buckets, counts, snapshot["sum"]))
+        lines.extend(_gauge_lines("event_loop_recent_stalls", "Stalls held in the watchdog's recent buffer",
+                                  [((), len(monitor.stalls))]))
+        return lines
+    return collect_loop_lag
+
+
+def admission_collector(controller):
+    def collect_admission():
+        snapshot = controller.snapshot()
+        lines = _gauge_lines("admission_global_inflight", "Requests admitted and in flight", [((), snapshot["inflight"])])
+        for field in ("inflight", "queued", "admitted", "rejected", "timed_out"):
+            is_counter = field not in ("inflight", "queued")
+            lines.extend(_gauge_lines(
+                f"admission_{field}{'_total' if is_counter else ''}",
+                f"Admission control {field.replace('_', ' ')} per route class",
+                [((("class", name),), c[field]) for name, c in snapshot["classes"].items()],
+                kind="counter" if is_counter else "gauge",
+            ))
+        return lines
+    return collect_admission
+
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path if path is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router fills in scope["route"], so the template is only known afterwards
+            REQUEST_LATENCY.labels(scope["method"], route_template(scope), status_holder[0]).observe(
+                time.perf_counter() - started)
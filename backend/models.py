@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
 from database import Base
 
 
@@ -9,4 +10,41 @@ class User(Base):
     name = Column(String(50), nullable = False)
     email = Column(String(100), unique = True, index = True, nullable = False)
     password = Column(String(100),nullable = False)
-    avatar = Column(String, nullable = True)
\ No newline at end of file
+    avatar = Column(String, nullable = True)
+    avatar_placeholder = Column(String, nullable = True)
+    updated_at = Column(DateTime, nullable = True, default = datetime.utcnow, onupdate = datetime.utcnow, index = True)
+
+
+class Job(Base):
+    __tablename__ = "job"
+    id = Column(Integer, primary_key = True, index = True)
+    name = Column(String(100), nullable = False)
+    payload = Column(JSON, nullable = False, default = dict)
+    status = Column(String(20), nullable = False, default = "queued", index = True)
+    attempts = Column(Integer, nullable = False, default = 0)
+    max_attempts = Column(Integer, nullable = False, default = 5)
+    run_at = Column(DateTime, nullable = False, default = datetime.utcnow, index = True)
+    locked_at = Column(DateTime, nullable = True)
+    last_error = Column(Text, nullable = True)
+    created_at = Column(DateTime, nullable = False, default = datetime.utcnow)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_token"
+    id = Column(Integer, primary_key = True, index = True)
+    user_id = Column(Integer, nullable = False, index = True)
+    # sha256 of the opaque token; the token itself is only ever sent to the client
+    token_hash = Column(String(64), unique = True, index = True, nullable = False)
+    family_id = Column(String(32), nullable = False, index = True)
+    access_jti = Column(String(32), nullable = True, index = True)
+    expires_at = Column(DateTime, nullable = False, index = True)
+    created_at = Column(DateTime, nullable = False, default = datetime.utcnow)
+    revoked_at = Column(DateTime, nullable = True)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_token"
+    id = Column(Integer, primary_key = True, index = True)
+    jti = Column(String(32), unique = True, nullable = False)
+    expires_at = Column(DateTime, nullable = False, index = True)
+    created_at = Column(DateTime, nullable = False, default = datetime.utcnow, index = True)
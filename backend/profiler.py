@@ -0,0 +1,173 @@
+# On-demand sampling CPU profiler.
+#
+# A background thread walks sys._current_frames() every few milliseconds and
+# counts the stacks it sees. Nothing is traced or hooked, so the overhead is
+# one stack walk per interval regardless of traffic, which makes it safe to run
+# against live load. Stacks are returned either in the collapsed format used
+# by flamegraph.pl / inferno ("a;b;c 42") or as speedscope JSON.
+#
+# Two ways to bound a session:
+#   seconds  - sample the whole worker for N seconds
+#   requests - sample only while requests matching a path prefix are in
+#              flight, until N of them have finished (ProfilerMiddleware
+#              keeps the count). Other threads active at the same time are
+#              sampled as well; filter by frame in the flamegraph if needed.
+
+import collections
+import os
+import sys
+import threading
+import time
+
+
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+# leaf frames of threads that are just parked waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self):
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.duration = 0.0
+
+    def add(self, stack):
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self, name: str = "profile"):
+        frame_index, frames = {}, []
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            indexes = []
+            for label in stack:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(frame_index[label])
+            samples.append(indexes)
+            weights.append(count)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "backend-profiler",
+        }
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILER_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # request mode bookkeeping, touched by ProfilerMiddleware
+        self.path_prefix = None
+        self.session = 0
+        self.active_requests = 0
+        self.finished_requests = 0
+
+    def _sample(self, profile: Profile, own_thread: int):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            stack.reverse()
+            profile.add(tuple(stack))
+
+    def _run(self, should_stop, should_sample):
+        profile = Profile()
+        own_thread = threading.get_ident()
+        started = time.monotonic()
+        while not should_stop() and time.monotonic() - started < PROFILER_MAX_SECONDS:
+            if should_sample():
+                self._sample(profile, own_thread)
+            time.sleep(self.interval)
+        profile.duration = time.monotonic() - started
+        return profile
+
+    def profile_for(self, seconds: float):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            deadline = time.monotonic() + seconds
+            return self._run(lambda: time.monotonic() >= deadline, lambda: True)
+        finally:
+            self._lock.release()
+
+    def profile_requests(self, path_prefix: str, requests: int, timeout: float):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            self.session += 1
+            self.active_requests = 0
+            self.finished_requests = 0
+            self.path_prefix = path_prefix
+            deadline = time.monotonic() + timeout
+            return self._run(
+                lambda: self.finished_requests >= requests or time.monotonic() >= deadline,
+                lambda: self.active_requests > 0,
+            )
+        finally:
+            self.path_prefix = None
+            self._lock.release()
+
+
+class ProfilerMiddleware:
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        prefix = self.profiler.path_prefix
+        if prefix is None or scope["type"] != "http" or not scope["path"].startswith(prefix):
+            await self.app(scope, receive, send)
+            return
+        # a request counted by an earlier session must not be subtracted from
+        # this one's counters when it finishes
+        session = self.profiler.session
+        self.profiler.active_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.profiler.session == session:
+                self.profiler.active_requests -= 1
+                self.profiler.finished_requests += 1
+
+
+profiler = SamplingProfiler()
@@ -16,9 +16,18 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class UserOut(BaseModel):
     username: str
     email: str
     name: str
     avatar: Optional[str] = None
+    avatar_placeholder: Optional[str] = None
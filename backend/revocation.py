@@ -0,0 +1,158 @@
+# Revoked access tokens.
+#
+# Logging out (or a detected refresh token reuse) revokes the access token's
+# jti until the token would have expired anyway. Revocations are written to the
+# revoked_token table and mirrored into an in-memory set in every worker, so
+# the per-request check is a single dict lookup. Entries are dropped when they
+# expire by a timing wheel: each jti sits in the bucket of its expiry tick and
+# advancing the wheel only touches the buckets that came due, instead of
+# scanning the whole set.
+#
+# Each worker picks up revocations made elsewhere by polling the table every
+# REVOCATION_SYNC_INTERVAL seconds for rows created since its last poll, minus
+# REVOCATION_SYNC_OVERLAP. Ids or timestamps are assigned before commit, so a
+# row can become visible after a newer one; the overlap re-reads that window
+# (and absorbs clock skew between hosts), and adding a known jti is a no-op.
+# Expired rows are deleted now and then.
+#
+# revoke() only stages the row; the jti enters this worker's set once the
+# session commits, so a rolled-back logout leaves no phantom revocation.
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, select
+
+import models
+from database import SessionLocal
+
+
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "2"))
+REVOCATION_SYNC_OVERLAP = float(os.getenv("REVOCATION_SYNC_OVERLAP", "60"))
+REVOCATION_PRUNE_INTERVAL = float(os.getenv("REVOCATION_PRUNE_INTERVAL", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationSet:
+    def __init__(self, resolution: float = 10.0, slots: int = 1024):
+        # resolution * slots is the horizon; later expiries wait in the last
+        # bucket and are re-filed when it comes due
+        self.resolution = resolution
+        self.slots = slots
+        self._expiry = {}
+        self._wheel = [[] for _ in range(slots)]
+        self._tick = math.floor(time.time() / resolution)
+        self._lock = threading.Lock()
+
+    def _file(self, jti: str, expires_at: float):
+        tick = min(math.floor(expires_at / self.resolution), self._tick + self.slots - 1)
+        self._wheel[max(tick, self._tick + 1) % self.slots].append(jti)
+
+    def add(self, jti: str, expires_at: float):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            if jti not in self._expiry:
+                self._file(jti, expires_at)
+            self._expiry[jti] = max(expires_at, self._expiry.get(jti, 0))
+
+    def __contains__(self, jti) -> bool:
+        expires_at = self._expiry.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def advance(self, now: float | None = None):
+        now = time.time() if now is None else now
+        target = math.floor(now / self.resolution)
+        with self._lock:
+            steps = min(target - self._tick, self.slots)
+            due = []
+            for step in range(1, steps + 1):
+                index = (self._tick + step) % self.slots
+                due.extend(self._wheel[index])
+                self._wheel[index] = []
+            self._tick = max(self._tick, target)
+            for jti in due:
+                expires_at = self._expiry.get(jti)
+                if expires_at is None:
+                    continue
+                if expires_at <= now:
+                    del self._expiry[jti]
+                else:
+                    self._file(jti, expires_at)
+
+
+class RevocationSync:
+    def __init__(self, revoked: RevocationSet, overlap: float = REVOCATION_SYNC_OVERLAP):
+        self.revoked = revoked
+        self.overlap = timedelta(seconds=overlap)
+        self.last_sync = None
+        self._last_prune = 0.0
+
+    def sync(self):
+        started = datetime.utcnow()
+        RevokedToken = models.RevokedToken
+        query = select(RevokedToken.jti, RevokedToken.expires_at).where(RevokedToken.expires_at > started)
+        if self.last_sync is not None:
+            query = query.where(RevokedToken.created_at >= self.last_sync - self.overlap)
+        db = SessionLocal()
+        try:
+            for row in db.execute(query):
+                self.revoked.add(row.jti, _timestamp(row.expires_at))
+            self.last_sync = started
+            if time.monotonic() - self._last_prune > REVOCATION_PRUNE_INTERVAL:
+                self._last_prune = time.monotonic()
+                cutoff = datetime.utcnow() - timedelta(minutes=1)
+                db.execute(delete(RevokedToken).where(RevokedToken.expires_at < cutoff))
+                db.execute(delete(models.RefreshToken).where(models.RefreshToken.expires_at < cutoff))
+                db.commit()
+        finally:
+            db.close()
+        self.revoked.advance()
+
+    async def run_periodically(self, interval: float = REVOCATION_SYNC_INTERVAL):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception:
+                logger.exception("Revocation sync failed")
+            await asyncio.sleep(interval)
+
+
+def _timestamp(value: datetime):
+    # columns hold naive UTC datetimes
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+def revoke(db, jti: str, expires_at: datetime):
+    # staged on the caller's session; see _publish_revocations
+    pending = db.info.setdefault("revoked_jtis", {})
+    if not jti or jti in pending or db.query(models.RevokedToken.id).filter(models.RevokedToken.jti == jti).first():
+        return
+    db.add(models.RevokedToken(jti=jti, expires_at=expires_at))
+    pending[jti] = _timestamp(expires_at)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_revocations(session):
+    # this worker stops accepting the tokens right away, the others within
+    # REVOCATION_SYNC_INTERVAL
+    for jti, expires_at in session.info.pop("revoked_jtis", {}).items():
+        revoked_tokens.add(jti, expires_at)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_revocations(session):
+    session.info.pop("revoked_jtis", None)
+
+
+revoked_tokens = RevocationSet()
+revocation_sync = RevocationSync(revoked_tokens)
@@ -0,0 +1,90 @@
+# Schema upgrades for existing databases.
+#
+# Base.metadata.create_all() creates missing tables but never alters an
+# existing one, so a column added to a model would make every query against
+# an older database fail with "no such column". Such columns are listed in
+# ADDED_COLUMNS, indexes added later in ADDED_INDEXES, and both are created
+# here; each step checks the live schema first, so running it again (every
+# startup, every worker) is a no-op.
+#
+# main.py runs upgrade() in the lifespan handler right after create_all. To
+# upgrade by hand before deploying, run from the backend directory:
+#   python schema.py
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, text, update
+
+import models
+
+
+# arbitrary constant for pg_advisory_xact_lock, so workers don't race on the DDL
+UPGRADE_LOCK_ID = 4512002
+
+logger = logging.getLogger(__name__)
+
+
+def _backfill_person_updated_at(conn):
+    # existing rows count as changed now; the index the model declares is
+    # only created by create_all for new tables
+    person = models.User.__table__
+    conn.execute(update(person).where(person.c.updated_at.is_(None)).values(updated_at=datetime.utcnow()))
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_person_updated_at ON person (updated_at)")
+
+
+def _backfill_revoked_token_created_at(conn):
+    revoked = models.RevokedToken.__table__
+    conn.execute(update(revoked).where(revoked.c.created_at.is_(None)).values(created_at=datetime.utcnow()))
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_revoked_token_created_at ON revoked_token (created_at)")
+
+
+# (table, column, column DDL, optional step run after adding the column)
+ADDED_COLUMNS = [
+    ("person", "avatar_placeholder", "VARCHAR", None),
+    ("person", "updated_at", "TIMESTAMP", _backfill_person_updated_at),
+    ("revoked_token", "created_at", "TIMESTAMP", _backfill_revoked_token_created_at),
+]
+
+# indexes added to tables that already existed; create_all skips those tables
+# (name, table, column)
+ADDED_INDEXES = [
+    ("ix_refresh_token_access_jti", "refresh_token", "access_jti"),
+]
+
+
+def upgrade(engine):
+    added = []
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": UPGRADE_LOCK_ID})
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+        for table, column, ddl, after in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if column in {c["name"] for c in inspector.get_columns(table)}:
+                continue
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            if after is not None:
+                after(conn)
+            logger.info("Added column", extra={"table": table, "column": column})
+            added.append(f"{table}.{column}")
+        for name, table, column in ADDED_INDEXES:
+            if table not in tables:
+                continue
+            if name in {i["name"] for i in inspector.get_indexes(table)}:
+                continue
+            conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
+            logger.info("Added index", extra={"table": table, "index": name})
+            added.append(name)
+    return added
+
+
+if __name__ == "__main__":
+    import log_config
+    from database import Base, engine
+
+    log_config.setup_logging()
+    Base.metadata.create_all(bind=engine)
+    print("Added:", ", ".join(upgrade(engine)) or "nothing, schema is current")
@@ -0,0 +1,236 @@
+# Production launcher: a supervisor process running a pool of uvicorn workers.
+#
+#   python serve.py
+#
+# Workers are spawned (not forked) so each imports the app fresh, and run on
+# uvloop + httptools when they are installed (uvicorn[standard]). They either
+# share one listening socket bound by the supervisor, or with WEB_REUSE_PORT=1
+# each bind their own with SO_REUSEPORT and let the kernel spread connections.
+# The shared socket is the default: on a rolling restart, connections still in
+# a retiring worker's SO_REUSEPORT accept queue would be reset.
+#
+# Signals to the supervisor:
+#   SIGHUP          rolling restart: one worker at a time, a replacement is
+#                   started and waits until its lifespan (warm-up) finished
+#                   before the old one is asked to drain and exit. Workers in
+#                   other slots that crash meanwhile are still replaced.
+#   SIGTERM/SIGINT  graceful shutdown of every worker
+#
+# Workers exit by themselves after WEB_MAX_REQUESTS (+ jitter) requests and are
+# replaced, which bounds the effect of slow leaks and fragmentation.
+#
+# Configuration, from the environment like the app's own settings:
+#   WEB_HOST, WEB_PORT             listen address (default 0.0.0.0:8000)
+#   WEB_WORKERS                    worker processes (default: CPU count)
+#   WEB_REUSE_PORT=1               per-worker SO_REUSEPORT sockets
+#   WEB_BACKLOG                    listen backlog (default 2048)
+#   WEB_MAX_REQUESTS               recycle a worker after this many requests (0 = never)
+#   WEB_MAX_REQUESTS_JITTER        random extra requests per worker, so they don't recycle together
+#   WEB_GRACEFUL_TIMEOUT           seconds a worker may spend draining connections
+#   WEB_STARTUP_TIMEOUT            seconds a new worker has to become ready
+#   WEB_KEEPALIVE                  idle keep-alive timeout in seconds
+#   WEB_LOOP, WEB_HTTP             override uvicorn's loop/http implementation
+
+import importlib.util
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+import log_config
+
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0")) or os.cpu_count() or 1
+WEB_REUSE_PORT = os.getenv("WEB_REUSE_PORT", "0") == "1"
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "0"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_STARTUP_TIMEOUT = float(os.getenv("WEB_STARTUP_TIMEOUT", "60"))
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+WEB_LOOP = os.getenv("WEB_LOOP") or ("uvloop" if importlib.util.find_spec("uvloop") else "asyncio")
+WEB_HTTP = os.getenv("WEB_HTTP") or ("httptools" if importlib.util.find_spec("httptools") else "h11")
+
+APP = "main:app"
+
+logger = logging.getLogger("serve")
+
+
+def bind_socket(host: str, port: int, reuse_port: bool, backlog: int = WEB_BACKLOG):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class ReadyServer(uvicorn.Server):
+    # tells the supervisor once startup (including the lifespan warm-up) is done
+    def __init__(self, config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            self.ready.set()
+
+
+def run_worker(sock, ready, max_requests: int):
+    if sock is None:
+        sock = bind_socket(WEB_HOST, WEB_PORT, reuse_port=True)
+    config = uvicorn.Config(
+        APP,
+        loop=WEB_LOOP,
+        http=WEB_HTTP,
+        lifespan="on",
+        log_config=None,
+        access_log=False,
+        timeout_keep_alive=WEB_KEEPALIVE,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+        limit_max_requests=max_requests or None,
+    )
+    ReadyServer(config, ready).run(sockets=[sock])
+
+
+class Worker:
+    def __init__(self, context, sock, slot: int):
+        self.slot = slot
+        self.ready = context.Event()
+        max_requests = 0
+        if WEB_MAX_REQUESTS:
+            max_requests = WEB_MAX_REQUESTS + random.randint(0, WEB_MAX_REQUESTS_JITTER)
+        self.process = context.Process(
+            target=run_worker, args=(sock, self.ready, max_requests), name=f"web-worker-{slot}", daemon=False,
+        )
+        self.started = time.monotonic()
+        self.process.start()
+
+    def stop(self, timeout: float):
+        # SIGTERM makes uvicorn stop accepting, finish in-flight requests
+        # (up to WEB_GRACEFUL_TIMEOUT) and run the lifespan shutdown
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning("Worker did not drain in time, killing it", extra={"pid": self.process.pid})
+            self.process.kill()
+            self.process.join()
+
+
+class Supervisor:
+    def __init__(self, workers: int = WEB_WORKERS, reuse_port: bool = WEB_REUSE_PORT):
+        self.size = workers
+        self.reuse_port = reuse_port
+        self.context = multiprocessing.get_context("spawn")
+        self.sock = None
+        self.workers = {}
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self, slot: int):
+        worker = Worker(self.context, self.sock, slot)
+        logger.info("Worker started", extra={"slot": slot, "pid": worker.process.pid})
+        return worker
+
+    def handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reload_requested = True
+        else:
+            self.stopping = True
+
+    def wait(self, done, timeout: float, skip: int | None = None):
+        # polls done() while keeping the rest of the pool supervised
+        deadline = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() >= deadline:
+                return False
+            self.reap(skip=skip)
+            time.sleep(0.2)
+        return True
+
+    def rolling_restart(self):
+        logger.info("Rolling restart", extra={"workers": len(self.workers)})
+        for slot in sorted(self.workers):
+            if self.stopping:
+                return
+            old = self.workers[slot]
+            new = self.spawn(slot)
+            self.wait(lambda: new.ready.is_set() or not new.process.is_alive() or self.stopping,
+                      WEB_STARTUP_TIMEOUT, skip=slot)
+            if self.stopping:
+                new.stop(WEB_GRACEFUL_TIMEOUT)
+                return
+            if not new.ready.is_set():
+                # keep serving with the old code rather than shrinking the pool
+                logger.error("Replacement worker failed to start, aborting restart", extra={"slot": slot})
+                new.stop(WEB_GRACEFUL_TIMEOUT)
+                return
+            self.workers[slot] = new
+            if old.process.is_alive():
+                old.process.terminate()
+            self.wait(lambda: not old.process.is_alive(), WEB_GRACEFUL_TIMEOUT + 5)
+            old.stop(0)
+        logger.info("Rolling restart finished")
+
+    def reap(self, skip: int | None = None):
+        for slot, worker in list(self.workers.items()):
+            if slot == skip or worker.process.is_alive():
+                continue
+            code = worker.process.exitcode
+            logger.log(logging.INFO if code == 0 else logging.WARNING, "Worker exited",
+                       extra={"slot": slot, "pid": worker.process.pid, "exitcode": code})
+            if time.monotonic() - worker.started < 1:
+                # crashing on startup; don't spin
+                time.sleep(1)
+            self.workers[slot] = self.spawn(slot)
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = bind_socket(WEB_HOST, WEB_PORT, reuse_port=False)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self.handle_signal)
+        logger.info("Starting workers", extra={
+            "workers": self.size, "address": f"{WEB_HOST}:{WEB_PORT}", "reuse_port": self.reuse_port,
+            "loop": WEB_LOOP, "http": WEB_HTTP, "max_requests": WEB_MAX_REQUESTS,
+        })
+        for slot in range(self.size):
+            self.workers[slot] = self.spawn(slot)
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+            self.reap()
+            time.sleep(0.2)
+
+        logger.info("Shutting down workers")
+        for worker in self.workers.values():
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers.values():
+            worker.stop(WEB_GRACEFUL_TIMEOUT + 5)
+        if self.sock is not None:
+            self.sock.close()
+
+
+def main():
+    log_config.setup_logging()
+    Supervisor().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Server-Timing response header.
+#
+# Each request gets a small dict in a contextvar; code wraps interesting work
+# in `with server_timing.phase("db"):` and the middleware writes the totals
+# into a Server-Timing header, e.g.
+#   Server-Timing: auth;dur=1.9, db;dur=0.6;desc="2 queries", hash;dur=171.3, total;dur=175.0
+# Phases can nest (auth includes its user lookup, which is also counted in db),
+# so they are not expected to add up to total.
+#
+# With SERVER_TIMING_ACCESS_LOG=1 the same breakdown is attached to the
+# request's access log record.
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import log_config
+
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") == "1"
+SERVER_TIMING_ACCESS_LOG = os.getenv("SERVER_TIMING_ACCESS_LOG", "0") == "1"
+
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+
+def record(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is None:
+        return
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def phase(name: str):
+    if _timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def format_header(timings: dict, total: float):
+    parts = []
+    for name, (seconds, count) in timings.items():
+        part = f"{name};dur={seconds * 1000:.1f}"
+        if name == "db":
+            part += f';desc="{count} queries"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_db_timer(conn, cursor, statement, parameters, context, executemany):
+        context._server_timing_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_db_timer(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_server_timing_started", None)
+        if started is not None:
+            record("db", time.perf_counter() - started)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app, access_log: bool = SERVER_TIMING_ACCESS_LOG):
+        self.app = app
+        self.access_log = access_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                header = format_header(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            if self.access_log:
+                log_config.update_request_context(
+                    server_timing={name: round(seconds * 1000, 3) for name, (seconds, _) in timings.items()})
@@ -0,0 +1,198 @@
+# Shared-memory cache for workers on one host (CACHE_BACKEND=shm).
+#
+# A fixed-size, set-associative hash table in an mmap'd file under /dev/shm,
+# shared by every worker process: memory is paid once per host and an entry
+# written by one worker is immediately visible to (and evictable by) all.
+#
+# Layout: a 64 byte header, then `buckets * ways` slots of `slot_size` bytes.
+# A key hashes (blake2b, stable across processes) to one bucket; lookups scan
+# its ways, inserts reuse the key's way, then an empty or expired one, else
+# evict the way closest to expiry. Each slot starts with a sequence counter:
+#
+#   seq u32 | key hash u64 | expires f64 (0 = empty) | key len u16 | value len u16 | key | value
+#
+# Readers take no lock (seqlock): read seq, copy the slot, read seq again and
+# retry if it changed or was odd. Writers serialize on flock() of the file plus
+# a thread lock, make seq odd, write, then make it even again. Values are
+# compact JSON; entries that do not fit in a slot are simply not cached.
+#
+# Configuration:
+#   SHM_CACHE_PATH       base path (default /dev/shm/react-app-cache, or the temp dir)
+#   SHM_CACHE_SLOTS      total slots (default 8192)
+#   SHM_CACHE_SLOT_SIZE  bytes per slot (default 1024)
+#   CACHE_TTL            entry lifetime in seconds, shared with the other backends
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from cache import Cache, CACHE_TTL
+
+
+SHM_CACHE_PATH = os.getenv(
+    "SHM_CACHE_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "react-app-cache"),
+)
+SHM_CACHE_SLOTS = int(os.getenv("SHM_CACHE_SLOTS", "8192"))
+SHM_CACHE_SLOT_SIZE = int(os.getenv("SHM_CACHE_SLOT_SIZE", "1024"))
+
+MAGIC = b"SHMCACH1"
+HEADER = struct.Struct("<8sIII")  # magic, buckets, ways, slot size
+HEADER_SIZE = 64
+SEQ = struct.Struct("<I")
+SLOT = struct.Struct("<IQdHH")
+WAYS = 4
+READ_RETRIES = 8
+
+
+def _hash(key: bytes):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class ShmCache(Cache):
+    def __init__(self, name: str, path: str = SHM_CACHE_PATH, slots: int = SHM_CACHE_SLOTS,
+                 slot_size: int = SHM_CACHE_SLOT_SIZE, ttl: float = CACHE_TTL):
+        self.name = name
+        self.buckets = max(1, slots // WAYS)
+        self.slot_size = slot_size
+        self.ttl = ttl
+        # the layout is part of the file name, so workers started with a
+        # different configuration (e.g. mid rolling restart) never share a file
+        self.path = f"{path}-{name}-{self.buckets * WAYS}x{slot_size}"
+        self.size = HEADER_SIZE + self.buckets * WAYS * slot_size
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    @property
+    def map(self):
+        # opened on first use rather than at import
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    self._open()
+        return self._map
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            mapped = mmap.mmap(fd, self.size)
+            magic, buckets, ways, slot_size = HEADER.unpack_from(mapped, 0)
+            if (magic, buckets, ways, slot_size) != (MAGIC, self.buckets, WAYS, self.slot_size):
+                mapped[:] = bytes(self.size)
+                HEADER.pack_into(mapped, 0, MAGIC, self.buckets, WAYS, self.slot_size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map = fd, mapped
+
+    def _offsets(self, key_hash: int):
+        base = HEADER_SIZE + (key_hash % self.buckets) * WAYS * self.slot_size
+        return [base + way * self.slot_size for way in range(WAYS)]
+
+    def _read(self, mapped, offset: int):
+        for _ in range(READ_RETRIES):
+            before = SEQ.unpack_from(mapped, offset)[0]
+            if before & 1:
+                continue
+            raw = mapped[offset:offset + self.slot_size]
+            if SEQ.unpack_from(mapped, offset)[0] == before:
+                return raw
+        return None
+
+    def _write(self, mapped, offset: int, key_hash: int, expires: float, key: bytes = b"", value: bytes = b""):
+        seq = SEQ.unpack_from(mapped, offset)[0]
+        SEQ.pack_into(mapped, offset, (seq + 1) & 0xFFFFFFFF)
+        end = offset + SLOT.size
+        mapped[end:end + len(key) + len(value)] = key + value
+        SLOT.pack_into(mapped, offset, (seq + 1) & 0xFFFFFFFF, key_hash, expires, len(key), len(value))
+        SEQ.pack_into(mapped, offset, (seq + 2) & 0xFFFFFFFF)
+
+    @contextlib.contextmanager
+    def _writer(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, mapped, key_hash: int, encoded: bytes):
+        for offset in self._offsets(key_hash):
+            _, slot_hash, _, key_len, _ = SLOT.unpack_from(mapped, offset)
+            if slot_hash == key_hash and mapped[offset + SLOT.size:offset + SLOT.size + key_len] == encoded:
+                return offset
+        return None
+
+    def get(self, key: str):
+        mapped = self.map
+        encoded = key.encode()
+        key_hash = _hash(encoded)
+        now = time.time()
+        for offset in self._offsets(key_hash):
+            raw = self._read(mapped, offset)
+            if raw is None:
+                continue
+            _, slot_hash, expires, key_len, value_len = SLOT.unpack_from(raw)
+            if slot_hash != key_hash or expires < now or raw[SLOT.size:SLOT.size + key_len] != encoded:
+                continue
+            start = SLOT.size + key_len
+            self._count(True)
+            return json.loads(raw[start:start + value_len])
+        self._count(False)
+        return None
+
+    def set(self, key: str, value, ttl: float | None = None):
+        encoded = key.encode()
+        payload = json.dumps(value, separators=(",", ":")).encode()
+        if SLOT.size + len(encoded) + len(payload) > self.slot_size:
+            return
+        mapped = self.map
+        key_hash = _hash(encoded)
+        now = time.time()
+        with self._writer():
+            target = self._find(mapped, key_hash, encoded)
+            if target is None:
+                # an empty or expired way, else the one closest to expiry
+                target = min(self._offsets(key_hash), key=lambda offset: SLOT.unpack_from(mapped, offset)[2])
+            self._write(mapped, target, key_hash, now + (ttl or self.ttl), encoded, payload)
+
+    def delete(self, *keys: str):
+        mapped = self.map
+        with self._writer():
+            for key in keys:
+                encoded = key.encode()
+                offset = self._find(mapped, _hash(encoded), encoded)
+                if offset is not None:
+                    self._write(mapped, offset, 0, 0.0)
+
+    def clear(self):
+        mapped = self.map
+        with self._writer():
+            for offset in range(HEADER_SIZE, self.size, self.slot_size):
+                self._write(mapped, offset, 0, 0.0)
+
+    def stats(self):
+        mapped = self.map
+        now = time.time()
+        live = sum(
+            1 for offset in range(HEADER_SIZE, self.size, self.slot_size)
+            if SLOT.unpack_from(mapped, offset)[2] >= now
+        )
+        return {"path": self.path, "slots": self.buckets * WAYS, "slot_size": self.slot_size, "live": live}
+
+    def stop(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = self._fd = None
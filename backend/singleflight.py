@@ -0,0 +1,69 @@
+# Single-flight request coalescing.
+#
+# When several requests need the same thing at the same moment (a page firing
+# a few /profile GETs at once, or every request for a user right after its
+# cache entry expired), only the first one does the work; the others await the
+# same in-flight task and get the same result or exception. Once it completes
+# the key is released, so nothing is cached here. That stays the job of
+# cache.py.
+#
+# The call runs as its own task, so a caller that is cancelled (e.g. the
+# client went away) neither cancels it for the others nor leaves them hanging.
+# The result object is shared by all callers, so return immutable values or
+# snapshots and do not mutate them.
+#
+#   group = Group("user")
+#   user = await group.do(key, load_user, user_id)
+#
+#   @singleflight(key=lambda user_id: user_id)
+#   async def load_user(user_id): ...
+#
+# Groups coalesce within one event loop, i.e. per worker process.
+
+import asyncio
+import functools
+
+from metrics import SINGLEFLIGHT_CALLS
+
+
+class Group:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._release, key))
+        else:
+            SINGLEFLIGHT_CALLS.labels(self.name, "shared").inc()
+        return await asyncio.shield(task)
+
+    def _release(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # if every caller was cancelled nobody retrieves the exception
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def singleflight(key=None, name: str | None = None):
+    # key(*args, **kwargs) -> hashable; defaults to the arguments themselves
+    def decorate(func):
+        group = Group(name or func.__qualname__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key is not None else (args, tuple(sorted(kwargs.items())))
+            return await group.do(call_key, func, *args, **kwargs)
+
+        wrapper.group = group
+        return wrapper
+
+    return decorate
@@ -0,0 +1,369 @@
+# Lightweight request tracing.
+#
+# TracingMiddleware opens a root span per request (continuing an incoming W3C
+# traceparent if there is one) and code opens child spans with
+# `with tracing.span("name"):`. SQL statements are traced through SQLAlchemy
+# engine events. Finished traces go to a background exporter thread, either
+# as JSON lines on disk or as OTLP/HTTP JSON to a collector.
+#
+# Sampling:
+#   head - TRACE_SAMPLE_RATIO of new traces (or the caller's sampled flag) are
+#          recorded and always exported.
+#   tail - with TRACE_TAIL_LATENCY_MS set, unsampled traces are still recorded
+#          in memory and exported only if they turn out slow or failed.
+# When neither applies, span() is a no-op that only reads a contextvar.
+#
+# For local work run a collector stand-in that accepts OTLP/HTTP JSON:
+#   python tracing.py collect --port 4318 --out traces.jsonl
+
+import argparse
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")  # none | jsonl | otlp
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "0.01"))
+TRACE_TAIL_LATENCY_MS = float(os.getenv("TRACE_TAIL_LATENCY_MS", "0"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "256"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "react-app-basic-backend")
+TRACE_ENABLED = TRACE_EXPORTER != "none"
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "error")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.error = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: str | None, attributes: dict):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = False
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self, error: bool = False):
+        self.end_ns = time.time_ns()
+        if error:
+            self.error = True
+            self.trace.error = True
+        if len(self.trace.spans) < TRACE_MAX_SPANS:
+            self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name: str, **attributes):
+    parent = _current.get()
+    if parent is None:
+        return None, None
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    return child, _current.set(child)
+
+
+def end_span(child, token, error: bool = False):
+    if child is None:
+        return
+    _current.reset(token)
+    child.finish(error)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    child, token = start_span(name, **attributes)
+    if child is None:
+        yield None
+        return
+    try:
+        yield child
+    except BaseException:
+        end_span(child, token, error=True)
+        raise
+    end_span(child, token)
+
+
+def parse_traceparent(value: str | None):
+    # version-traceid-parentid-flags, e.g. 00-4bf9...-00f0...-01
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def format_traceparent(root: Span):
+    return f"00-{root.trace.trace_id}-{root.span_id}-{'01' if root.trace.sampled else '00'}"
+
+
+# Exporters
+
+class JsonFileExporter:
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, traces):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace in traces:
+                for s in trace.spans:
+                    f.write(json.dumps(s.to_dict(), default=str) + "\n")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpExporter:
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, traces):
+        spans = []
+        for trace in traces:
+            for s in trace.spans:
+                spans.append({
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 2 if s.parent_id is None else 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2 if s.error else 1},
+                })
+        body = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}).encode()
+        request = urllib.request.Request(self.endpoint, data=body, headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+class BatchExporter:
+    # Finished traces are handed over through a bounded queue, so a slow or
+    # unreachable collector drops traces instead of slowing down requests.
+
+    def __init__(self, exporter, max_queue: int = 2048, batch_size: int = 64, flush_interval: float = 2.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+            except Exception as exc:
+                logger.warning("Trace export failed", extra={"error": repr(exc), "traces": len(batch)})
+
+
+def build_exporter(kind: str = TRACE_EXPORTER):
+    if kind == "jsonl":
+        return BatchExporter(JsonFileExporter())
+    if kind == "otlp":
+        return BatchExporter(OtlpHttpExporter())
+    return None
+
+
+class TracingMiddleware:
+    def __init__(self, app, exporter: BatchExporter | None = None, sample_ratio: float = TRACE_SAMPLE_RATIO,
+                 tail_latency_ms: float = TRACE_TAIL_LATENCY_MS):
+        self.app = app
+        # built on first use (the middleware stack is assembled at startup),
+        # so importing the app does not start the exporter thread
+        self.exporter = exporter or build_exporter()
+        self.sample_ratio = sample_ratio
+        self.tail_latency_ms = tail_latency_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        if incoming:
+            trace_id, parent_id, sampled = incoming
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = random.random() < self.sample_ratio
+        if not sampled and not self.tail_latency_ms:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(trace_id, sampled)
+        root = Span(trace, f"{scope['method']} {scope['path']}", parent_id, {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        })
+        token = _current.set(root)
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"traceparent", format_traceparent(root).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+                root.set_attribute("http.route", route)
+            root.set_attribute("http.status_code", status_holder[0])
+            root.finish(error=status_holder[0] >= 500)
+            self._maybe_export(trace, root)
+
+    def _maybe_export(self, trace: Trace, root: Span):
+        if trace.sampled:
+            self.exporter.submit(trace)
+            return
+        duration_ms = (root.end_ns - root.start_ns) / 1e6
+        if trace.error or duration_ms >= self.tail_latency_ms:
+            self.exporter.submit(trace)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_sql_span(conn, cursor, statement, parameters, context, executemany):
+        child, token = start_span("db.query", **{"db.system": engine.dialect.name, "db.statement": statement[:500]})
+        context._trace_span = (child, token)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end_sql_span(conn, cursor, statement, parameters, context, executemany):
+        child, token = getattr(context, "_trace_span", (None, None))
+        end_span(child, token)
+
+    @event.listens_for(engine, "handle_error")
+    def _fail_sql_span(exception_context):
+        context = exception_context.execution_context
+        child, token = getattr(context, "_trace_span", (None, None)) if context is not None else (None, None)
+        end_span(child, token, error=True)
+
+
+# Local collector stand-in
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    out_path = "traces.jsonl"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        spans = 0
+        with open(self.out_path, "a", encoding="utf-8") as f:
+            for resource in json.loads(body or b"{}").get("resourceSpans", []):
+                for scope_spans in resource.get("scopeSpans", []):
+                    for s in scope_spans.get("spans", []):
+                        f.write(json.dumps(s) + "\n")
+                        spans += 1
+        print(f"received {spans} spans")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tracing utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    collect = sub.add_parser("collect", help="run a local OTLP/HTTP JSON collector that writes spans to a file")
+    collect.add_argument("--host", default="127.0.0.1")
+    collect.add_argument("--port", type=int, default=4318)
+    collect.add_argument("--out", default="traces.jsonl")
+    args = parser.parse_args(argv)
+
+    _CollectorHandler.out_path = args.out
+    server = ThreadingHTTPServer((args.host, args.port), _CollectorHandler)
+    print(f"Collecting traces on http://{args.host}:{args.port}/v1/traces -> {args.out}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Production traffic capture.
+#
+# With TRAFFIC_CAPTURE_FILE set, every (sampled) request is recorded as one
+# JSON line describing its shape: when it arrived, the route template, status,
+# latency and request/response body sizes. Bodies, headers and tokens are never
+# written; the caller's bearer token is reduced to a salted hash so requests of
+# the same user can be grouped without being identifiable.
+#
+# Records go through the same bounded, drop-on-overflow queue as application
+# logs, so capturing never blocks a request. Replay a capture with:
+#   python -m bench.replay traffic.jsonl --speed 2
+
+import atexit
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import secrets
+import time
+
+from log_config import DroppingQueueHandler
+
+
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE")
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+# set the same salt on every worker so identities line up across processes
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT") or secrets.token_hex(16)
+
+SKIPPED_PREFIXES = ("/debug", "/metrics", "/healthz", "/readyz", "/docs", "/openapi.json")
+
+
+def identity_hash(token: str, salt: str = TRAFFIC_CAPTURE_SALT):
+    return hmac.new(salt.encode(), token.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def build_capture_logger(path: str):
+    capture_logger = logging.getLogger("traffic_capture")
+    capture_logger.propagate = False
+    capture_logger.setLevel(logging.INFO)
+    capture_queue = queue.Queue(maxsize=10000)
+    capture_logger.handlers = [DroppingQueueHandler(capture_queue)]
+    writer = logging.FileHandler(path, encoding="utf-8")
+    writer.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(capture_queue, writer)
+    listener.start()
+    atexit.register(listener.stop)
+    return capture_logger
+
+
+class TrafficCaptureMiddleware:
+    def __init__(self, app, path: str = TRAFFIC_CAPTURE_FILE, sample: float = TRAFFIC_CAPTURE_SAMPLE):
+        self.app = app
+        self.sample = sample
+        self.logger = build_capture_logger(path)
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith(SKIPPED_PREFIXES)
+                or random.random() >= self.sample):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+        content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0]
+        arrived = time.time()
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status_holder = [500]
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.logger.info(json.dumps({
+                "t": round(arrived, 6),
+                "method": scope["method"],
+                "route": route,
+                "status": status_holder[0],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "req_bytes": sizes["request"],
+                "resp_bytes": sizes["response"],
+                "content_type": content_type or None,
+                "identity": identity_hash(token) if token else None,
+            }))
@@ -0,0 +1,143 @@
+# Warm-up before taking traffic.
+# A fresh worker pays several one-off costs on its first requests: an empty
+# connection pool, argon2's first allocation of its memory blocks, jose's key
+# setup and pydantic's lazily built serializers. The lifespan handler runs
+# these once before the app starts serving, and /readyz only reports ready
+# after they have succeeded (and stops doing so once shutdown begins), so a
+# load balancer never routes to a cold or draining worker.
+#
+# A failed warm-up (e.g. the database not reachable yet) is retried in the
+# background with backoff. After WARMUP_MAX_ATTEMPTS failures the worker
+# reports ready anyway, with a warning, rather than staying out of rotation for
+# the rest of its life; the steps that failed show up in /readyz.
+
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# 0 means "the pool's configured size"
+WARMUP_POOL_CONNECTIONS = int(os.getenv("WARMUP_POOL_CONNECTIONS", "0"))
+WARMUP_MAX_ATTEMPTS = int(os.getenv("WARMUP_MAX_ATTEMPTS", "5"))
+WARMUP_RETRY_DELAY = float(os.getenv("WARMUP_RETRY_DELAY", "1"))
+WARMUP_RETRY_MAX_DELAY = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+def warm_pool(engine, connections: int):
+    if connections <= 0:
+        size = getattr(engine.pool, "size", None)
+        connections = size() if callable(size) else 1
+    # hold them all at once so the pool really opens `connections` sockets
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+    return {"connections": len(opened)}
+
+
+def warm_password_hashing():
+    from UserAuthMethods import dummy_password_hash, get_password_hash, verify_password
+
+    dummy_password_hash()
+    hashed = get_password_hash("warm-up")
+    if not verify_password("warm-up", hashed):
+        raise RuntimeError("password hash round trip failed")
+
+
+def warm_tokens():
+    from UserAuthMethods import create_access_token, decode_access_token
+
+    token = create_access_token({"sub": "warm-up"}, timedelta(minutes=1))
+    if (decode_access_token(token) or {}).get("sub") != "warm-up":
+        raise RuntimeError("token round trip failed")
+
+
+def warm_serialization():
+    from pydantic_models import UserIn, UserLogin, UserOut
+
+    UserIn(username="warmup", name="Warm Up", email="warmup@example.com", password="warm-up")
+    UserLogin(email="warmup@example.com", password="warm-up")
+    UserOut(username="warmup", email="warmup@example.com", name="Warm Up",
+            avatar="0_warmup.png", avatar_placeholder=None).model_dump_json()
+
+
+class WarmUp:
+    def __init__(self):
+        self.ready = False
+        self.stopping = False
+        self.attempts = 0
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, engine, pool_connections: int = WARMUP_POOL_CONNECTIONS):
+        # blocking; called from the lifespan handler through asyncio.to_thread
+        self.started_at = time.time()
+        self.attempts += 1
+        self.steps = {}
+        steps = (
+            ("pool", lambda: warm_pool(engine, pool_connections)),
+            ("password_hash", warm_password_hashing),
+            ("token", warm_tokens),
+            ("serialization", warm_serialization),
+        )
+        ok = True
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                detail = step() or {}
+                self.steps[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 2), **detail}
+            except Exception as exc:
+                ok = False
+                self.steps[name] = {"ok": False, "error": repr(exc)}
+                logger.exception("Warm-up step failed", extra={"step": name})
+        self.finished_at = time.time()
+        self.ready = ok and not self.stopping
+        logger.info("Warm-up finished", extra={"ready": ok, "attempt": self.attempts, "steps": self.steps})
+        return ok
+
+    async def retry(self, engine, max_attempts: int = WARMUP_MAX_ATTEMPTS, delay: float = WARMUP_RETRY_DELAY):
+        # runs as a lifespan task after a failed first attempt
+        while self.attempts < max_attempts and not self.stopping:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+            if await asyncio.to_thread(self.run, engine):
+                return True
+        if not self.stopping:
+            logger.warning("Warm-up kept failing, serving without it",
+                           extra={"attempts": self.attempts, "steps": self.steps})
+            self.ready = True
+        return False
+
+    def stop(self):
+        # fail readiness first so load balancers stop routing here while we drain
+        self.stopping = True
+        self.ready = False
+
+    def skip(self):
+        self.ready = True
+        self.steps = {"skipped": {"ok": True}}
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "steps": self.steps,
+        }
+
+
+warmup = WarmUp()
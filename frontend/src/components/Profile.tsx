@@ -40,7 +40,8 @@ export const Profile: FC<ProfileProps> = ({
           <img
             src={user.avatar}
             alt="Avatar"
-            className="w-24 h-24 rounded-full object-cover mb-2"
+            className="w-24 h-24 rounded-full object-cover mb-2 bg-gray-600 bg-cover"
+            style={user.avatar_placeholder ? { backgroundImage: `url(${user.avatar_placeholder})` } : undefined}
           />
         ) : (
           <div className="w-24 h-24 rounded-full bg-gray-600 flex items-center justify-center mb-2">
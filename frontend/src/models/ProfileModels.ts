@@ -4,6 +4,7 @@ export interface User {
   name: string;
   email: string;
   avatar: string;
+  avatar_placeholder?: string | null;
 }
 
 export interface ProfileProps {